@@ -0,0 +1,217 @@
+#!/usr/bin/env python
+
+import os
+import sys
+import json
+import time
+import shutil
+import logging
+import argparse
+import platform
+import tempfile
+import subprocess
+from collections import defaultdict
+
+from sklearn.feature_extraction import DictVectorizer
+
+import features
+import preprocessing
+import hashing
+import sweep
+import synthetic
+from generate_ingredient_network import pmi_edges
+from extract_network_backbone import extract_backbone
+from compact_graph import CompactGraph
+
+def timed(func, repeat=1):
+    """ Returns (best wall time over repeat runs, result of the last run) """
+    best = None
+    for _ in xrange(repeat):
+        start = time.time()
+        result = func()
+        elapsed = time.time() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
+
+class Benchmark(object):
+    """ Runs the pipeline stages on a synthetic corpus of the given size """
+
+    def __init__(self, num_recipes, seed=0, repeat=1):
+        self.num_recipes = num_recipes
+        self.repeat = repeat
+        self.directory = tempfile.mkdtemp(prefix='tsukurepo-bench-')
+        self.recipes = list(synthetic.generate(num_recipes, seed))
+
+        split = int(num_recipes * 0.8)
+        self.num_train = split
+        self.train_file = os.path.join(self.directory, 'train.json')
+        self.dev_file = os.path.join(self.directory, 'dev.json')
+        for filename, recipes in ((self.train_file, self.recipes[:split]),
+                                  (self.dev_file, self.recipes[split:])):
+            with open(filename, 'w') as f:
+                for recipe in recipes:
+                    f.write('{}\n'.format(json.dumps(recipe)))
+
+    def close(self):
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+    def bench_normalize(self):
+        ingredients = [i for recipe in self.recipes for i in recipe['ingredients']]
+        def run():
+            for ingredient in ingredients:
+                list(preprocessing.normalize(ingredient))
+        return len(ingredients), run
+
+    def bench_normalize_batch(self):
+        batches = [recipe['ingredients'] for recipe in self.recipes]
+        def run():
+            for batch in batches:
+                preprocessing.normalize_batch(batch)
+        return sum(len(batch) for batch in batches), run
+
+    def bench_tokenize(self):
+        texts = [t for recipe in self.recipes for t in (recipe['name'], recipe['description'])]
+        def run():
+            for text in texts:
+                features.token_ids(text)
+        return len(texts), run
+
+    def bench_ngrams(self):
+        texts = [t for recipe in self.recipes for t in (recipe['name'], recipe['description'])]
+        def run():
+            for text in texts:
+                list(features.ngrams(text))
+        return len(texts), run
+
+    def bench_extract(self):
+        def run():
+            for instance in features.extract(self.train_file):
+                pass
+        return self.num_train, run
+
+    def _train_dicts(self):
+        return [f.todict() for f, label in features.extract(self.train_file)]
+
+    def bench_prune(self):
+        instances = self._train_dicts()
+        def run():
+            features.prune([dict(instance) for instance in instances],
+                           threshold=[0.002, 0.998])
+        return len(instances), run
+
+    def bench_vectorize(self):
+        instances = self._train_dicts()
+        def run():
+            DictVectorizer().fit_transform(instances)
+        return len(instances), run
+
+    def bench_hashing(self):
+        def run():
+            vectorizer = hashing.HashedVectorizer()
+            X, y = hashing.transform_file(vectorizer, self.train_file)
+            vectorizer.fit_prune(X, threshold=[0.002, 0.998])
+        return self.num_train, run
+
+    def bench_sweep(self):
+        vectorizer = DictVectorizer()
+        X_train = vectorizer.fit_transform(self._train_dicts())
+        y_train = [label for f, label in features.extract(self.train_file)]
+        X_dev = vectorizer.transform([f.todict()
+                                      for f, label in features.extract(self.dev_file)])
+        y_dev = [label for f, label in features.extract(self.dev_file)]
+        def run():
+            sweep.sweep(X_train, y_train, X_dev, y_dev, grid=(0.1, 1, 10))
+        return 3, run
+
+    def _ingredient2recipes(self):
+        ingredient2recipes = defaultdict(set)
+        for recipe in self.recipes:
+            for normalized in preprocessing.normalize_batch(recipe['ingredients']):
+                for ingredient in normalized:
+                    ingredient2recipes[ingredient].add(recipe['id'])
+        return ingredient2recipes
+
+    def bench_calc_pmis(self):
+        ingredient2recipes = self._ingredient2recipes()
+        valid_ingredients = set(ingredient2recipes)
+        def run():
+            pmi_edges(ingredient2recipes, valid_ingredients, self.num_recipes)
+        return len(valid_ingredients), run
+
+    def bench_extract_backbone(self):
+        ingredient2recipes = self._ingredient2recipes()
+        ingredients, recipe_counts, a, b, pmis = pmi_edges(
+            ingredient2recipes, set(ingredient2recipes), self.num_recipes)
+        graph = CompactGraph.from_edges(ingredients, a, b, pmis, recipe_counts)
+        def run():
+            extract_backbone(graph, 0.05)
+        return len(a), run
+
+    def run(self, stage):
+        items, func = getattr(self, 'bench_' + stage)()
+
+        def cold():
+            # every run starts without memoized normalizations
+            preprocessing.memo = preprocessing.NormalizeMemo()
+            return func()
+
+        seconds, _ = timed(cold, self.repeat)
+        return {
+            'seconds': seconds,
+            'items': items,
+            'items_per_second': items / seconds if seconds > 0 else None,
+        }
+
+STAGES = ('normalize', 'normalize_batch', 'tokenize', 'ngrams', 'extract', 'prune',
+          'vectorize', 'hashing', 'sweep', 'calc_pmis', 'extract_backbone')
+
+def git_commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', 'HEAD'],
+                                       cwd=os.path.dirname(os.path.abspath(__file__))).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def main():
+    logging.basicConfig(level=logging.INFO, format='%(message)s')
+
+    parser = argparse.ArgumentParser(description='Benchmark the pipeline stages on '
+                                                 'synthetic recipes')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1000, 10000],
+                        help='Numbers of recipes to benchmark with')
+    parser.add_argument('--stages', nargs='+', choices=STAGES, default=list(STAGES))
+    parser.add_argument('--repeat', type=int, default=3,
+                        help='Number of runs per stage, the best one is reported')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', help='JSON file to write the results to '
+                                         '(default: standard output)')
+    args = parser.parse_args()
+
+    results = {
+        'commit': git_commit(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'seed': args.seed,
+        'repeat': args.repeat,
+        'results': [],
+    }
+    for size in args.sizes:
+        benchmark = Benchmark(size, args.seed, args.repeat)
+        try:
+            for stage in args.stages:
+                result = benchmark.run(stage)
+                result.update({'stage': stage, 'num_recipes': size})
+                logging.info('{0} ({1} recipes): {2:.3f}s'.format(stage, size, result['seconds']))
+                results['results'].append(result)
+        finally:
+            benchmark.close()
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+    else:
+        json.dump(results, sys.stdout, indent=2, sort_keys=True)
+        sys.stdout.write('\n')
+
+if __name__ == '__main__':
+    main()
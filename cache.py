@@ -0,0 +1,120 @@
+#!/usr/bin/env python
+
+import sqlite3
+import threading
+from collections import OrderedDict
+
+class LRUCache(object):
+    """ Bounded in-memory mapping which evicts the least recently used key """
+
+    def __init__(self, maxsize=100000):
+        self.maxsize = maxsize
+        self.data = OrderedDict()
+
+    def get(self, key, default=None):
+        try:
+            value = self.data.pop(key)
+        except KeyError:
+            return default
+        self.data[key] = value
+        return value
+
+    def __setitem__(self, key, value):
+        self.data.pop(key, None)
+        self.data[key] = value
+        if len(self.data) > self.maxsize:
+            self.data.popitem(last=False)
+
+    def __contains__(self, key):
+        return key in self.data
+
+    def __len__(self):
+        return len(self.data)
+
+class PersistentCache(object):
+    """ Key-value store kept in a single sqlite file, with an LRU in front of it.
+    Keys and values are byte strings. It may be shared by the threads of a
+    process, but every process must open its own.
+
+    New entries are buffered in memory and written in one short transaction
+    per flush, and the file is in WAL mode, so that processes sharing it do
+    not hold its write lock while they work, nor block each other's reads. """
+
+    def __init__(self, filename, maxsize=100000, commit_every=1000):
+        self.filename = filename
+        self.maxsize = maxsize
+        self.commit_every = commit_every
+        self.memory = LRUCache(maxsize)
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.pending = {}
+        self.lock = threading.RLock()
+
+        self.db = sqlite3.connect(filename, timeout=60, check_same_thread=False)
+        self.db.execute('PRAGMA journal_mode=WAL')
+        self.db.execute('CREATE TABLE IF NOT EXISTS cache '
+                        '(key BLOB PRIMARY KEY, value BLOB)')
+        self.db.commit()
+
+    def get(self, key):
+        with self.lock:
+            return self._get(key)
+
+    def _get(self, key):
+        value = self.memory.get(key)
+        if value is not None:
+            self.hits += 1
+            return value
+        value = self.pending.get(key)
+        if value is not None:
+            self.hits += 1
+            return value
+
+        row = self.db.execute('SELECT value FROM cache WHERE key = ?',
+                              (sqlite3.Binary(key),)).fetchone()
+        if row is None:
+            self.misses += 1
+            return None
+
+        self.disk_hits += 1
+        value = bytes(row[0])
+        self.memory[key] = value
+        return value
+
+    def set(self, key, value):
+        with self.lock:
+            self.memory[key] = value
+            self.pending[key] = value
+            if len(self.pending) >= self.commit_every:
+                self.flush()
+
+    def flush(self):
+        with self.lock:
+            if self.pending:
+                self.db.executemany('INSERT OR REPLACE INTO cache (key, value) VALUES (?, ?)',
+                                    [(sqlite3.Binary(key), sqlite3.Binary(value))
+                                     for key, value in self.pending.iteritems()])
+                self.db.commit()
+                self.pending = {}
+
+    def close(self):
+        with self.lock:
+            self.flush()
+            self.db.close()
+
+    def stats(self, reset=False):
+        stats = {'hits': self.hits, 'disk_hits': self.disk_hits, 'misses': self.misses}
+        if reset:
+            self.hits = self.disk_hits = self.misses = 0
+        return stats
+
+    def merge_stats(self, stats):
+        """ Add counters reported by a cache living in another process """
+        self.hits += stats['hits']
+        self.disk_hits += stats['disk_hits']
+        self.misses += stats['misses']
+
+    def __len__(self):
+        self.flush()
+        return self.db.execute('SELECT COUNT(*) FROM cache').fetchone()[0]
@@ -6,29 +6,129 @@ import argparse
 from itertools import islice
 
 from sklearn.feature_extraction import DictVectorizer
-from sklearn.linear_model import LogisticRegression
-from sklearn.metrics import (f1_score, precision_recall_curve, auc, confusion_matrix,
-                             accuracy_score)
 import pylab as pl
 
 import features
+import preprocessing
+import hashing
+import streaming
+import sweep
+import instrument
+import pipeline
+import crossval
+import streaming_eval
+from matrix_cache import MatrixCache
+from feature_store import FeatureStore
 
-def read_dataset(filename, use_text_features):
+PRUNE_THRESHOLD = [0.002, 0.998]
+
+DATASETS = ('train', 'dev', 'test')
+
+def feature_mask(use_text_features):
     if use_text_features:
-        mask = set(['meta', 'text'])
+        return set(['meta', 'text'])
+    else:
+        return set(['meta'])
+
+def parse_grid(s):
+    return [float(c) for c in s.split(',')]
+
+def read_dataset(filename, use_text_features, jobs=1, store_dir=None, pipeline_threads=None):
+    mask = feature_mask(use_text_features)
+
+    if store_dir is not None:
+        # the store extracts in this process whatever jobs is, which is
+        # still used by the sweep and cross-validation
+        store = FeatureStore(os.path.join(store_dir, os.path.basename(filename) + '.db'))
+        num_read, num_extracted = store.update(filename)
+        logging.info('Extracted {0} new or changed recipes'.format(num_extracted))
+        X, y = store.dataset(mask)
+        store.close()
+        instrument.record('records', len(y))
+        instrument.record('extracted', num_extracted)
+        return X, y
+
+    if pipeline_threads is not None:
+        stream = pipeline.extract_pipelined(filename, *pipeline_threads)
     else:
-        mask = set(['meta'])
+        stream = features.extract_parallel(filename, jobs)
 
     X, y = [], []
-    points = list(features.filter(features.extract(filename), mask))
+    points = list(features.filter(stream, mask))
     for f, v in points:
         X.append(f.todict())
         y.append(v)
     return X, y
 
 
-def print_confusion_matrix(y_test, y_pred):
-    conf_mat = confusion_matrix(y_test, y_pred)
+def build_matrices(filenames, use_text_features, jobs=1, store_dir=None,
+                   pipeline_threads=None):
+    train_file, dev_file, test_file = filenames
+    vectorizer = DictVectorizer()
+
+    logging.info('Loading training data...')
+    with instrument.stage('extract train'):
+        X_train, y_train = read_dataset(train_file, use_text_features, jobs, store_dir,
+                                        pipeline_threads)
+
+    logging.info('Pruning training data...')
+    with instrument.stage('prune'):
+        X_train = features.prune(X_train, threshold=PRUNE_THRESHOLD)
+    with instrument.stage('vectorize train'):
+        X_train = vectorizer.fit_transform(X_train)
+        instrument.record_matrix(X_train)
+
+    logging.info('Loading development data...')
+    with instrument.stage('extract dev'):
+        X_dev, y_dev = read_dataset(dev_file, use_text_features, jobs, store_dir,
+                                    pipeline_threads)
+    with instrument.stage('vectorize dev'):
+        X_dev = vectorizer.transform(X_dev)
+        instrument.record_matrix(X_dev)
+
+    logging.info('Loading test data...')
+    with instrument.stage('extract test'):
+        X_test, y_test = read_dataset(test_file, use_text_features, jobs, store_dir,
+                                      pipeline_threads)
+    with instrument.stage('vectorize test'):
+        X_test = vectorizer.transform(X_test)
+        instrument.record_matrix(X_test)
+
+    return vectorizer, {'train': (X_train, y_train),
+                        'dev': (X_dev, y_dev),
+                        'test': (X_test, y_test)}
+
+
+def build_hashed_matrices(filenames, use_text_features, jobs=1,
+                          n_features=hashing.DEFAULT_N_FEATURES):
+    train_file, dev_file, test_file = filenames
+    vectorizer = hashing.HashedVectorizer(n_features, feature_mask(use_text_features))
+
+    logging.info('Loading training data...')
+    with instrument.stage('extract train'):
+        X_train, y_train = hashing.transform_file(vectorizer, train_file, jobs)
+
+    logging.info('Pruning training data...')
+    with instrument.stage('prune'):
+        X_train = vectorizer.fit_prune(X_train, threshold=PRUNE_THRESHOLD)
+        instrument.record_matrix(X_train)
+
+    logging.info('Loading development data...')
+    with instrument.stage('extract dev'):
+        X_dev, y_dev = hashing.transform_file(vectorizer, dev_file, jobs)
+        instrument.record_matrix(X_dev)
+
+    logging.info('Loading test data...')
+    with instrument.stage('extract test'):
+        X_test, y_test = hashing.transform_file(vectorizer, test_file, jobs)
+        instrument.record_matrix(X_test)
+
+    return vectorizer, {'train': (X_train, y_train),
+                        'dev': (X_dev, y_dev),
+                        'test': (X_test, y_test)}
+
+
+def print_conf_mat(conf_mat):
     actual = ' Actual '
     vertical_bar = ' | '
     horizontal_bar = '-'
@@ -48,9 +148,9 @@ def print_confusion_matrix(y_test, y_pred):
         print(line)
 
 
-def plot_pr_curve(filename, y_test, probas_):
-        precision, recall, thresholds = precision_recall_curve(y_test, probas_[:, 1])
-        area = auc(recall, precision)
+def plot_pr_curve(filename, evaluator):
+        precision, recall, thresholds = evaluator.pr_curve()
+        area = evaluator.pr_auc()
 
         pl.clf()
         pl.plot(recall, precision, label='Precision-Recall curve')
@@ -63,77 +163,263 @@ def plot_pr_curve(filename, y_test, probas_):
         pl.savefig(filename)
 
 
-def main():
-    logging.basicConfig(level=logging.INFO, format='%(message)s')
+def print_weights(vectorizer, model):
+    weights = vectorizer.inverse_transform(model.coef_)[0]
+    sorted_weights = sorted(weights.iteritems(), key=lambda x: x[1], reverse=True)
 
-    parser = argparse.ArgumentParser(description='Run classification')
-    parser.add_argument('prefix', help='directory which contains '
-                                       '{train,dev,test}.json')
-    parser.add_argument('--pr_curve', help='File to save precision-recall curve')
-    parser.add_argument('--model', help='Pickled file to save best model')
-    parser.add_argument('-t', action='store_true', help='Use text features')
+    def print_section(heading, iterator):
+        print(heading)
+        for i, (feat, weight) in enumerate(iterator):
+            print('{0:.4f}  {1}'.format(weight, feat.encode('utf8')))
 
-    args = parser.parse_args()
+    print_section('Most positive 1000 weights', islice(sorted_weights, 1000))
+    print_section('Most negative 1000 weights', islice(reversed(sorted_weights), 1000))
 
-    vectorizer = DictVectorizer()
 
-    logging.info('Loading training data...')
-    X_train, y_train = read_dataset(os.path.join(args.prefix, 'train.json'), args.t)
+def close_caches():
+    if features.token_cache is not None:
+        stats = features.token_cache.stats()
+        logging.info('Token cache: {0} memory hits, {1} disk hits, {2} misses'.format(
+            stats['hits'], stats['disk_hits'], stats['misses']))
+        features.token_cache.close()
+    preprocessing.memo.close()
+
+
+def save_model(filename, model, vectorizer, mask):
+    logging.info('Pickling best model...')
+    try:
+        import cPickle as pickle
+    except:
+        import pickle
+    with open(filename, 'w') as f:
+        pickle.dump({'model': model, 'vectorizer': vectorizer, 'mask': mask}, f)
+
+
+def run_streaming(args, filenames):
+    train_file, dev_file, test_file = filenames
+    vectorizer = hashing.HashedVectorizer(args.n_features, feature_mask(args.t))
 
     logging.info('Pruning training data...')
-    X_train = features.prune(X_train, threshold=[0.002, 0.998])
-    X_train = vectorizer.fit_transform(X_train)
+    with instrument.stage('prune'):
+        label_counts = streaming.fit_prune(vectorizer, train_file, PRUNE_THRESHOLD,
+                                           args.batch_size, args.jobs)
+
+    logging.info('Training...')
+    with instrument.stage('train'):
+        model = streaming.train(vectorizer, train_file, args.epochs, args.batch_size,
+                                args.jobs, args.alpha, dev_filename=dev_file,
+                                class_weight=streaming.class_weights(label_counts),
+                                shuffle_batches=args.shuffle_batches)
+
+    logging.info('Testing...')
+    with instrument.stage('test'):
+        evaluator = streaming.evaluate(model, vectorizer, test_file, args.batch_size,
+                                       args.jobs, args.pr_bins, scores=bool(args.pr_curve))
+    close_caches()
+    print_evaluation(args, evaluator, vectorizer, model)
+
+
+def pipeline_threads(args):
+    if args.pipeline:
+        return (args.decode_threads, args.tokenize_threads)
+    return None
+
+
+def print_evaluation(args, evaluator, vectorizer, model):
+    print('Test score: {0}'.format(evaluator.f1()))
+    print('Test accuracy: {0}'.format(evaluator.accuracy()))
+
+    print_weights(vectorizer, model)
+
+    print_conf_mat(evaluator.conf_mat)
+
+    if args.pr_curve:
+        plot_pr_curve(args.pr_curve, evaluator)
+
+    if args.model:
+        save_model(args.model, model, vectorizer, feature_mask(args.t))
+
+
+def test_model(args, model, vectorizer, X_test, y_test):
+    with instrument.stage('predict test'):
+        evaluator = streaming_eval.evaluate(model, X_test, y_test, args.batch_size,
+                                            args.pr_bins, scores=bool(args.pr_curve))
+    print_evaluation(args, evaluator, vectorizer, model)
+
+
+def run_cv(args, filenames):
+    train_file, dev_file, test_file = filenames
+
+    logging.info('Loading training data...')
+    with instrument.stage('extract train'):
+        X_train, y_train = read_dataset(train_file, args.t, args.jobs, args.feature_store,
+                                        pipeline_threads(args))
 
     logging.info('Loading development data...')
-    X_dev, y_dev = read_dataset(os.path.join(args.prefix, 'dev.json'), args.t)
-    X_dev = vectorizer.transform(X_dev)
+    with instrument.stage('extract dev'):
+        X_dev, y_dev = read_dataset(dev_file, args.t, args.jobs, args.feature_store,
+                                    pipeline_threads(args))
+
+    with instrument.stage('vectorize'):
+        cv = crossval.CrossValidation(X_train + X_dev, y_train + y_dev, args.cv)
+        instrument.record_matrix(cv.X)
+    del X_train, X_dev
+
+    logging.info('Loading test data...')
+    with instrument.stage('extract test'):
+        X_test, y_test = read_dataset(test_file, args.t, args.jobs, args.feature_store,
+                                      pipeline_threads(args))
+
+    close_caches()
+
+    logging.info('Cross-validating...')
+    with instrument.stage('cross-validate'):
+        report = cv.run(args.C, args.jobs, PRUNE_THRESHOLD)
+        instrument.record('results', report)
+    best_regularization = crossval.best_regularization(report)
 
     logging.info('Training...')
-    scores = []
-    for regularization in (0.01, 0.1, 1, 10, 100, 1000):
-        model = LogisticRegression(penalty='l1', C=regularization, class_weight='auto')
-        logging.info('regularization parameter: {0}'.format(regularization))
-        model.fit(X_train, y_train)
-        score = f1_score(y_dev, model.predict(X_dev))
-        scores.append((score, regularization, model))
-        logging.info('Dev score: {0}'.format(score))
+    with instrument.stage('train'):
+        model, vectorizer = cv.fit(best_regularization, PRUNE_THRESHOLD)
 
-    best_score, best_regularization, best_model = max(scores)
+    best = [result for result in report if result['C'] == best_regularization][0]
+    print('Tuned regularization parameter: {0} (score={1} +/- {2})'.format(
+        best_regularization, best['mean_f1'], best['stdev_f1']))
+    test_model(args, model, vectorizer, vectorizer.transform(X_test), y_test)
 
-    logging.info('Loading test data...')
-    X_test, y_test = read_dataset(os.path.join(args.prefix, 'test.json'), args.t)
-    X_test = vectorizer.transform(X_test)
-    y_pred = best_model.predict(X_test)
+
+def run(args, filenames):
+    def build():
+        if args.hashing:
+            return build_hashed_matrices(filenames, args.t, args.jobs, args.n_features)
+        return build_matrices(filenames, args.t, args.jobs, args.feature_store,
+                              pipeline_threads(args))
+
+    if args.cache:
+        matrix_cache = MatrixCache(args.cache)
+        key = matrix_cache.key(filenames, feature_mask(args.t), PRUNE_THRESHOLD,
+                               hashing=args.n_features if args.hashing else None)
+        if key in matrix_cache:
+            logging.info('Loading cached feature matrices...')
+            with instrument.stage('load cached matrices'):
+                vectorizer, datasets = matrix_cache.load(key)
+        else:
+            vectorizer, datasets = build()
+            logging.info('Caching feature matrices...')
+            with instrument.stage('cache matrices'):
+                matrix_cache.save(key, vectorizer, datasets)
+    else:
+        vectorizer, datasets = build()
+
+    close_caches()
+
+    X_train, y_train = datasets['train']
+    X_dev, y_dev = datasets['dev']
+    X_test, y_test = datasets['test']
+
+    logging.info('Training...')
+    with instrument.stage('sweep'):
+        best_score, best_regularization, best_model = sweep.sweep(
+            X_train, y_train, X_dev, y_dev, grid=args.C, jobs=args.jobs,
+            patience=args.patience, warm_start=args.warm_start)
 
     print('Tuned regularization parameter: {0} (score={1})'.format(best_regularization,
                                                                    best_score))
-    print('Test score: {0}'.format(f1_score(y_test, y_pred)))
+    test_model(args, best_model, vectorizer, X_test, y_test)
 
-    weights = vectorizer.inverse_transform(best_model.coef_)[0]
-    sorted_weights = sorted(weights.iteritems(), key=lambda x: x[1], reverse=True)
 
-    def print_weights(heading, iterator):
-        print(heading)
-        for i, (feat, weight) in enumerate(iterator):
-            print('{0:.4f}  {1}'.format(weight, feat.encode('utf8')))
+def main():
+    logging.basicConfig(level=logging.INFO, format='%(message)s')
 
-    print_weights('Most positive 1000 weights', islice(sorted_weights, 1000))
-    print_weights('Most negative 1000 weights', islice(reversed(sorted_weights), 1000))
+    parser = argparse.ArgumentParser(description='Run classification')
+    parser.add_argument('prefix', help='directory which contains '
+                                       '{train,dev,test}.json')
+    parser.add_argument('--pr_curve', help='File to save precision-recall curve')
+    parser.add_argument('--pr_bins', type=int, default=streaming_eval.DEFAULT_BINS,
+                        help='Number of score bins the precision-recall curve is '
+                             'computed from')
+    parser.add_argument('--model', help='Pickled file to save best model')
+    parser.add_argument('-t', action='store_true', help='Use text features')
+    parser.add_argument('--jobs', type=int, default=1,
+                        help='Number of processes used for feature extraction and '
+                             'the regularization sweep')
+    parser.add_argument('--token_cache', help='sqlite file used to cache MeCab output '
+                                              'across runs')
+    parser.add_argument('--normalize_memo', help='sqlite file used to memoize ingredient '
+                                                 'normalization across runs')
+    parser.add_argument('--cache', help='Directory used to cache feature matrices '
+                                        'across runs')
+    parser.add_argument('--feature_store', help='Directory of feature stores, so that only '
+                                                'new or changed recipes are extracted, in a '
+                                                'single process even with --jobs (not used '
+                                                'with --hashing, --streaming or --pipeline)')
+    parser.add_argument('--pipeline', action='store_true',
+                        help='Extract features in a pipeline of threads which read, decode, '
+                             'tokenize and vectorize concurrently (not used with --hashing '
+                             'or --streaming)')
+    parser.add_argument('--decode_threads', type=int, default=1,
+                        help='Number of JSON decoding threads of the pipeline')
+    parser.add_argument('--tokenize_threads', type=int, default=1,
+                        help='Number of MeCab threads of the pipeline')
+    parser.add_argument('--hashing', action='store_true',
+                        help='Hash features into a fixed-size space instead of '
+                             'building a vocabulary')
+    parser.add_argument('--n_features', type=int, default=hashing.DEFAULT_N_FEATURES,
+                        help='Size of the hashed feature space')
+    parser.add_argument('--C', type=parse_grid, default=sweep.DEFAULT_GRID,
+                        help='Comma separated regularization parameters to try')
+    parser.add_argument('--patience', type=int,
+                        help='Stop the sweep after this many parameters in a row '
+                             'fail to improve the dev score')
+    parser.add_argument('--warm_start', action='store_true',
+                        help='Fit the parameters in increasing order as a warm-started '
+                             'regularization path (requires the saga solver)')
+    parser.add_argument('--cv', type=int,
+                        help='Tune the regularization parameter by stratified k-fold '
+                             'cross-validation on train and dev with this many folds, '
+                             'instead of on the dev split')
+    parser.add_argument('--streaming', action='store_true',
+                        help='Train out of core on hashed minibatches')
+    parser.add_argument('--batch_size', type=int, default=10000,
+                        help='Number of recipes per minibatch in streaming mode, '
+                             'and per chunk when evaluating on test')
+    parser.add_argument('--epochs', type=int, default=5,
+                        help='Number of passes over the training data in streaming mode')
+    parser.add_argument('--shuffle_batches', type=int, default=streaming.SHUFFLE_BATCHES,
+                        help='Number of minibatches whose recipes are shuffled together '
+                             'in every epoch in streaming mode')
+    parser.add_argument('--alpha', type=float, default=0.0001,
+                        help='Regularization strength in streaming mode')
+    parser.add_argument('--profile', help='JSON file to write per-stage timings, '
+                                          'throughput and memory usage to')
 
-    print_confusion_matrix(y_test, y_pred)
+    args = parser.parse_args()
+    if args.cv and (args.hashing or args.streaming):
+        parser.error('--cv cannot be combined with --hashing or --streaming')
+    if args.feature_store and (args.hashing or args.streaming or args.pipeline):
+        parser.error('--feature_store cannot be combined with --hashing, --streaming '
+                     'or --pipeline')
 
-    if args.pr_curve:
-        probas_ = best_model.predict_proba(X_test)
-        plot_pr_curve(args.pr_curve, y_test, probas_)
+    if args.profile:
+        instrument.enable()
+    if args.token_cache:
+        features.use_token_cache(args.token_cache)
+    if args.normalize_memo:
+        preprocessing.use_memo(args.normalize_memo)
+    if args.feature_store and not os.path.isdir(args.feature_store):
+        os.makedirs(args.feature_store)
 
-    if args.model:
-        logging.info('Pickling best model...')
-        try:
-            import cPickle as pickle
-        except:
-            import pickle
-        with open(args.model, 'w') as f:
-            pickle.dump({'model': best_model, 'vectorizer': vectorizer}, f)
+    filenames = [os.path.join(args.prefix, name + '.json') for name in DATASETS]
+
+    if args.streaming:
+        run_streaming(args, filenames)
+    elif args.cv:
+        run_cv(args, filenames)
+    else:
+        run(args, filenames)
+
+    if args.profile:
+        instrument.save(args.profile)
 
 if __name__ == '__main__':
     main()
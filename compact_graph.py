@@ -0,0 +1,142 @@
+#!/usr/bin/env python
+
+import os
+import io
+import json
+import argparse
+try:
+    import cPickle as pickle
+except:
+    import pickle
+
+import numpy as np
+
+class CompactGraph(object):
+    """ Undirected weighted graph stored as a symmetric CSR adjacency.
+
+    On disk it is a directory of .npy arrays plus a JSON table of node
+    names, so that it can be loaded through memory mapping. Conversion
+    to networkx only happens when explicitly asked for. """
+
+    def __init__(self, nodes, indptr, indices, weights, num_recipes):
+        self.nodes = nodes
+        self.indptr = indptr
+        self.indices = indices
+        self.weights = weights
+        self.num_recipes = num_recipes
+
+    def __len__(self):
+        return len(self.nodes)
+
+    @classmethod
+    def from_edges(cls, nodes, u, v, w, num_recipes, drop_isolated=True):
+        """ Builds the graph from edges given once each, as indices into nodes """
+        u = np.asarray(u, dtype=np.int64)
+        v = np.asarray(v, dtype=np.int64)
+        w = np.asarray(w, dtype=np.float32)
+        num_recipes = np.asarray(num_recipes, dtype=np.int32)
+
+        if drop_isolated:
+            used = np.zeros(len(nodes), dtype=bool)
+            used[u] = True
+            used[v] = True
+            new_index = np.cumsum(used) - 1
+            nodes = [node for node, keep in zip(nodes, used) if keep]
+            num_recipes = num_recipes[used]
+            u, v = new_index[u], new_index[v]
+
+        rows = np.concatenate([u, v])
+        cols = np.concatenate([v, u])
+        weights = np.concatenate([w, w])
+        order = np.lexsort((cols, rows))
+        indptr = np.zeros(len(nodes) + 1, dtype=np.int64)
+        np.cumsum(np.bincount(rows, minlength=len(nodes)), out=indptr[1:])
+        return cls(nodes, indptr, cols[order].astype(np.int32), weights[order], num_recipes)
+
+    @classmethod
+    def from_networkx(cls, g):
+        nodes = g.nodes()
+        node_index = dict((node, i) for i, node in enumerate(nodes))
+        edges = list(g.edges_iter(data=True))
+        u = [node_index[a] for a, b, d in edges]
+        v = [node_index[b] for a, b, d in edges]
+        w = [d['weight'] for a, b, d in edges]
+        num_recipes = [g.node[node]['num_recipes'] for node in nodes]
+        return cls.from_edges(nodes, u, v, w, num_recipes, drop_isolated=False)
+
+    def edges(self):
+        """ Returns (u, v, w) arrays with every edge once, u < v """
+        rows = np.repeat(np.arange(len(self.nodes)), np.diff(self.indptr))
+        upper = rows < self.indices
+        return rows[upper], self.indices[upper].astype(np.int64), self.weights[upper]
+
+    def degree(self):
+        return np.diff(self.indptr)
+
+    def neighbors(self, i):
+        """ Returns (neighbor indices, weights) of the i-th node """
+        row = slice(self.indptr[i], self.indptr[i + 1])
+        return self.indices[row], self.weights[row]
+
+    def to_networkx(self):
+        import networkx as nx
+        g = nx.Graph()
+        for i, node in enumerate(self.nodes):
+            g.add_node(node, num_recipes=int(self.num_recipes[i]))
+        u, v, w = self.edges()
+        for i, j, weight in zip(u.tolist(), v.tolist(), w.tolist()):
+            g.add_edge(self.nodes[i], self.nodes[j], weight=weight)
+        return g
+
+    def save(self, path):
+        if not os.path.isdir(path):
+            os.makedirs(path)
+        np.save(os.path.join(path, 'indptr.npy'), self.indptr)
+        np.save(os.path.join(path, 'indices.npy'), self.indices)
+        np.save(os.path.join(path, 'weights.npy'), self.weights)
+        np.save(os.path.join(path, 'num_recipes.npy'), self.num_recipes)
+        with io.open(os.path.join(path, 'nodes.json'), 'w', encoding='utf8') as f:
+            f.write(unicode(json.dumps(self.nodes, ensure_ascii=False)))
+
+    @classmethod
+    def load(cls, path, mmap_mode='r'):
+        def load_array(name):
+            return np.load(os.path.join(path, name + '.npy'), mmap_mode=mmap_mode)
+        with io.open(os.path.join(path, 'nodes.json'), encoding='utf8') as f:
+            nodes = json.load(f)
+        return cls(nodes, load_array('indptr'), load_array('indices'),
+                   load_array('weights'), load_array('num_recipes'))
+
+def is_compact(path):
+    return os.path.isdir(path)
+
+def load_graph(path):
+    """ Loads a compact graph directory, or a pickled networkx graph """
+    if is_compact(path):
+        return CompactGraph.load(path)
+    with open(path) as f:
+        return CompactGraph.from_networkx(pickle.load(f))
+
+def save_graph(graph, path):
+    """ Saves the graph in the format implied by the path: .gexf and .pkl
+    are converted to networkx, anything else is written as a compact graph """
+    if path.endswith('.gexf'):
+        import networkx as nx
+        nx.write_gexf(graph.to_networkx(), path, encoding='utf-8')
+    elif path.endswith('.pkl'):
+        with open(path, 'w') as f:
+            pickle.dump(graph.to_networkx(), f)
+    else:
+        graph.save(path)
+
+def main():
+    parser = argparse.ArgumentParser(description='Convert between graph formats')
+    parser.add_argument('input', help='Input compact graph directory or network pkl file')
+    parser.add_argument('output', help='Output compact graph directory, '
+                                       'or network gexf or pkl file')
+    args = parser.parse_args()
+
+    save_graph(load_graph(args.input), args.output)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,151 @@
+#!/usr/bin/env python
+
+import os
+import io
+import sys
+import json
+import logging
+import argparse
+try:
+    import cPickle as pickle
+except:
+    import pickle
+
+import numpy as np
+
+from compact_graph import load_graph
+
+DEFAULT_K = 20
+
+class ComplementIndex(object):
+    """ Top-k complements of every ingredient, by PMI.
+
+    Ingredients are numbered as in the ingredient-ID mapping. The partners of
+    ingredient i are neighbors[indptr[i]:indptr[i + 1]], in decreasing order
+    of PMI, and their PMIs are at the same positions of weights. On disk it
+    is a directory of .npy arrays plus a JSON table of ingredient names, so
+    that queries only touch the rows they ask for. """
+
+    def __init__(self, names, indptr, neighbors, weights, k):
+        self.names = names
+        self.indptr = indptr
+        self.neighbors = neighbors
+        self.weights = weights
+        self.k = k
+        self.ingredient2id = dict((name, i) for i, name in enumerate(names) if name is not None)
+
+    def __len__(self):
+        return len(self.names)
+
+    def __contains__(self, ingredient):
+        return ingredient in self.ingredient2id
+
+    @classmethod
+    def build(cls, graph, ingredient2id, k=DEFAULT_K):
+        """ Keeps the k heaviest edges of every node of a CompactGraph, ties
+        broken by ingredient id. Nodes missing from ingredient2id are dropped. """
+        num_ingredients = max(ingredient2id.itervalues()) + 1 if ingredient2id else 0
+        names = [None] * num_ingredients
+        for name, i in ingredient2id.iteritems():
+            names[i] = name
+
+        node_ids = np.array([ingredient2id.get(node, -1) for node in graph.nodes],
+                            dtype=np.int64)
+        rows = np.repeat(np.arange(len(graph)), np.diff(graph.indptr))
+        source, target = node_ids[rows], node_ids[np.asarray(graph.indices)]
+        weights = np.asarray(graph.weights)
+        known = (source >= 0) & (target >= 0)
+        source, target, weights = source[known], target[known], weights[known]
+
+        order = np.lexsort((target, -weights, source))
+        source, target, weights = source[order], target[order], weights[order]
+        degree = np.bincount(source, minlength=num_ingredients)
+        start = np.cumsum(degree) - degree
+        top = np.arange(len(source)) - start[source] < k
+
+        indptr = np.zeros(num_ingredients + 1, dtype=np.int64)
+        np.cumsum(np.minimum(degree, k), out=indptr[1:])
+        return cls(names, indptr, target[top].astype(np.int32),
+                   weights[top].astype(np.float32), k)
+
+    def save(self, path):
+        if not os.path.isdir(path):
+            os.makedirs(path)
+        np.save(os.path.join(path, 'indptr.npy'), self.indptr)
+        np.save(os.path.join(path, 'neighbors.npy'), self.neighbors)
+        np.save(os.path.join(path, 'weights.npy'), self.weights)
+        with io.open(os.path.join(path, 'names.json'), 'w', encoding='utf8') as f:
+            f.write(unicode(json.dumps({'names': self.names, 'k': self.k},
+                                       ensure_ascii=False)))
+
+    @classmethod
+    def load(cls, path, mmap_mode='r'):
+        def load_array(name):
+            return np.load(os.path.join(path, name + '.npy'), mmap_mode=mmap_mode)
+        with io.open(os.path.join(path, 'names.json'), encoding='utf8') as f:
+            meta = json.load(f)
+        return cls(meta['names'], load_array('indptr'), load_array('neighbors'),
+                   load_array('weights'), meta['k'])
+
+    def query_id(self, i, k=None):
+        """ Returns (ids, PMIs) of the top k complements of the i-th ingredient """
+        start, end = self.indptr[i], self.indptr[i + 1]
+        if k is not None:
+            end = min(end, start + k)
+        return self.neighbors[start:end], self.weights[start:end]
+
+    def query(self, ingredient, k=None):
+        """ Returns [(ingredient, PMI)] for the top k complements of a normalized
+        ingredient. Raises KeyError if it is not in the mapping. """
+        ids, weights = self.query_id(self.ingredient2id[ingredient], k)
+        return [(self.names[j], weight) for j, weight in zip(ids.tolist(), weights.tolist())]
+
+    def query_batch(self, ingredients, k=None):
+        """ Same as query for every ingredient, with None for unknown ones """
+        return [self.query(ingredient, k) if ingredient in self else None
+                for ingredient in ingredients]
+
+def main():
+    logging.basicConfig(level=logging.INFO, format='%(message)s')
+
+    parser = argparse.ArgumentParser(description='Build or query the top-k complements '
+                                                 'of every ingredient')
+    subparsers = parser.add_subparsers(dest='command')
+
+    build_parser = subparsers.add_parser('build', help='Build the index from a network')
+    build_parser.add_argument('network', help='Input network directory or network pkl file')
+    build_parser.add_argument('mapping', help='Input ingredient-ID mapping file')
+    build_parser.add_argument('index', help='Output index directory')
+    build_parser.add_argument('--k', type=int, default=DEFAULT_K,
+                              help='Number of complements kept per ingredient')
+
+    query_parser = subparsers.add_parser('query', help='Print the complements of ingredients')
+    query_parser.add_argument('index', help='Index directory')
+    query_parser.add_argument('ingredients', nargs='*',
+                              help='Normalized ingredients (default: one per line from stdin)')
+    query_parser.add_argument('--k', type=int, help='Number of complements to print')
+    args = parser.parse_args()
+
+    if args.command == 'build':
+        with open(args.mapping, 'r') as f:
+            ingredient2id = pickle.load(f)['ingredient2id']
+        index = ComplementIndex.build(load_graph(args.network), ingredient2id, args.k)
+        index.save(args.index)
+        logging.info('Indexed {} complements of {} ingredients'.format(
+            len(index.neighbors), len(index)))
+    else:
+        index = ComplementIndex.load(args.index)
+        if args.ingredients:
+            ingredients = [ingredient.decode('utf8') for ingredient in args.ingredients]
+        else:
+            ingredients = [line.decode('utf8').strip() for line in sys.stdin if line.strip()]
+        for ingredient, complements in zip(ingredients, index.query_batch(ingredients, args.k)):
+            if complements is None:
+                logging.warning('Unknown ingredient: {}'.format(ingredient.encode('utf8')))
+                continue
+            for complement, weight in complements:
+                sys.stdout.write(u'{}\t{}\t{:.4f}\n'.format(ingredient, complement,
+                                                            weight).encode('utf8'))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,216 @@
+#!/usr/bin/env python
+
+import os
+import io
+import json
+import shutil
+import logging
+import argparse
+import tempfile
+from array import array
+from collections import defaultdict
+
+import numpy as np
+import scipy.sparse as sp
+
+import jsonl
+import preprocessing
+import corpus_index
+import instrument
+
+def incidence_matrix(ingredient2recipes, ingredients):
+    """ Sparse recipe x ingredient matrix, with a one wherever
+    the recipe uses the ingredient """
+    recipe_index = {}
+    rows, cols = array('i'), array('i')
+    for j, ingredient in enumerate(ingredients):
+        for recipe_id in ingredient2recipes[ingredient]:
+            rows.append(recipe_index.setdefault(recipe_id, len(recipe_index)))
+            cols.append(j)
+    rows = np.frombuffer(rows, dtype=np.intc) if rows else np.zeros(0, dtype=np.intc)
+    cols = np.frombuffer(cols, dtype=np.intc) if cols else np.zeros(0, dtype=np.intc)
+    return sp.csc_matrix((np.ones(len(rows), dtype=np.int64), (rows, cols)),
+                         shape=(len(recipe_index), len(ingredients)))
+
+def cooccurrences(incidence):
+    """ Returns (a, b, count) arrays for every pair of columns a < b
+    which co-occur in at least one row """
+    counts = sp.triu(incidence.T.dot(incidence), k=1).tocoo()
+    nonzero = counts.data > 0
+    return counts.row[nonzero], counts.col[nonzero], counts.data[nonzero]
+
+class CooccurrenceStore(object):
+    """ Ingredient co-occurrence counts, updated in place as recipes come in.
+
+    Holds the number of recipes using every normalized ingredient, the
+    number of recipes using every pair of them, as (a, b, count) arrays
+    sorted by a then b with a < b, and the sorted ids of the counted
+    recipes. Ingredient ids are given in order of first appearance, so
+    that they stay valid as batches are merged in. """
+
+    ARRAYS = ('recipe_ids', 'ingredient_counts', 'pair_a', 'pair_b', 'pair_counts')
+
+    def __init__(self, ingredients, recipe_ids, ingredient_counts, pair_a, pair_b, pair_counts):
+        self.ingredients = ingredients
+        self.recipe_ids = recipe_ids
+        self.ingredient_counts = ingredient_counts
+        self.pair_a = pair_a
+        self.pair_b = pair_b
+        self.pair_counts = pair_counts
+        self.ingredient_index = dict((ingredient, i) for i, ingredient in enumerate(ingredients))
+
+    @classmethod
+    def empty(cls):
+        return cls([], np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64),
+                   np.zeros(0, dtype=np.int32), np.zeros(0, dtype=np.int32),
+                   np.zeros(0, dtype=np.int64))
+
+    @property
+    def num_recipes(self):
+        return len(self.recipe_ids)
+
+    @property
+    def num_pairs(self):
+        return len(self.pair_counts)
+
+    def add(self, ingredient2recipes, recipe_ids):
+        """ Merges in the recipes of recipe_ids, given the ids of the recipes
+        using each ingredient. Recipes already counted are skipped, so a batch
+        overlapping the previous ones is not counted twice. Only the batch
+        and the stored pairs are looked at. Returns the number of recipes added. """
+        recipe_ids = np.unique(np.asarray(recipe_ids, dtype=np.int64))
+        new_ids = recipe_ids[~np.in1d(recipe_ids, self.recipe_ids)]
+        if len(new_ids) < len(recipe_ids):
+            ingredient2recipes = dict(
+                (ingredient, recipes[np.in1d(recipes, new_ids)]) for ingredient, recipes in
+                ((ingredient, np.array(list(recipes), dtype=np.int64))
+                 for ingredient, recipes in ingredient2recipes.iteritems()))
+        # recipes without any ingredient still count towards num_recipes,
+        # as they do for load_ingredient2recipes
+        self.recipe_ids = np.union1d(self.recipe_ids, new_ids)
+        names = [ingredient for ingredient, recipes in ingredient2recipes.iteritems()
+                 if len(recipes) > 0]
+        if not names:
+            return len(new_ids)
+
+        for ingredient in names:
+            if ingredient not in self.ingredient_index:
+                self.ingredient_index[ingredient] = len(self.ingredients)
+                self.ingredients.append(ingredient)
+        ids = np.array([self.ingredient_index[ingredient] for ingredient in names],
+                       dtype=np.int64)
+        num_ingredients = len(self.ingredients)
+
+        incidence = incidence_matrix(ingredient2recipes, names)
+        ingredient_counts = np.zeros(num_ingredients, dtype=np.int64)
+        ingredient_counts[:len(self.ingredient_counts)] = self.ingredient_counts
+        ingredient_counts[ids] += np.asarray(incidence.sum(axis=0)).ravel()
+
+        # a < b in the batch's columns does not imply it for the store's ids
+        a, b, counts = cooccurrences(incidence)
+        a, b = ids[a], ids[b]
+        a, b = np.minimum(a, b), np.maximum(a, b)
+        pairs = sp.coo_matrix((np.concatenate([self.pair_counts, counts]),
+                               (np.concatenate([self.pair_a, a]),
+                                np.concatenate([self.pair_b, b]))),
+                              shape=(num_ingredients, num_ingredients)).tocsr()
+        pairs.sum_duplicates()
+        pairs.sort_indices()
+        pairs = pairs.tocoo()
+
+        self.ingredient_counts = ingredient_counts
+        self.pair_a = pairs.row.astype(np.int32)
+        self.pair_b = pairs.col.astype(np.int32)
+        self.pair_counts = pairs.data.astype(np.int64)
+        return len(new_ids)
+
+    def update(self, filename, batch_size=100000):
+        """ Merges in the recipes of a (possibly compressed) JSONL file or of a
+        corpus index, batch_size recipes at a time. Returns the number of
+        recipes added. """
+        if corpus_index.is_index(filename):
+            index = corpus_index.CorpusIndex.load(filename)
+            return self.add(index.ingredient2recipes(), index.recipe_ids)
+
+        added = 0
+        ingredient2recipes, recipe_ids = defaultdict(set), []
+        for recipe in jsonl.records(filename, ['id', 'ingredients']):
+            instrument.count('records')
+            recipe_id = recipe['id']
+            recipe_ids.append(recipe_id)
+            for normalized_ingredients in preprocessing.normalize_batch(recipe['ingredients']):
+                for normalized_ingredient in normalized_ingredients:
+                    ingredient2recipes[normalized_ingredient].add(recipe_id)
+            if len(recipe_ids) >= batch_size:
+                added += self.add(ingredient2recipes, recipe_ids)
+                ingredient2recipes, recipe_ids = defaultdict(set), []
+        if recipe_ids:
+            added += self.add(ingredient2recipes, recipe_ids)
+        return added
+
+    def save(self, path):
+        # write next to path first and swap the directories, so that an
+        # interrupted update leaves the previous store intact
+        parent = os.path.dirname(os.path.abspath(path))
+        tmp = tempfile.mkdtemp(dir=parent)
+        try:
+            for name in self.ARRAYS:
+                np.save(os.path.join(tmp, name + '.npy'), getattr(self, name))
+            with io.open(os.path.join(tmp, 'vocabulary.json'), 'w', encoding='utf8') as f:
+                f.write(unicode(json.dumps(self.ingredients, ensure_ascii=False)))
+            if os.path.exists(path):
+                old = tempfile.mkdtemp(dir=parent)
+                os.rmdir(old)
+                os.rename(path, old)
+                os.rename(tmp, path)
+                shutil.rmtree(old)
+            else:
+                os.rename(tmp, path)
+        except:
+            shutil.rmtree(tmp, ignore_errors=True)
+            raise
+
+    @classmethod
+    def load(cls, path, mmap_mode='r'):
+        arrays = dict((name, np.load(os.path.join(path, name + '.npy'), mmap_mode=mmap_mode))
+                      for name in cls.ARRAYS)
+        with io.open(os.path.join(path, 'vocabulary.json'), encoding='utf8') as f:
+            ingredients = json.load(f)
+        return cls(ingredients=ingredients, **arrays)
+
+def is_store(path):
+    return os.path.isdir(path) and os.path.exists(os.path.join(path, 'pair_counts.npy'))
+
+def main():
+    logging.basicConfig(level=logging.INFO, format='%(message)s')
+
+    parser = argparse.ArgumentParser(description='Merge recipes into an ingredient '
+                                                 'co-occurrence store')
+    parser.add_argument('store', help='Co-occurrence store directory, created if missing')
+    parser.add_argument('json', nargs='+', help='Input data files or corpus index directories')
+    parser.add_argument('--batch_size', type=int, default=100000,
+                        help='Number of recipes merged at once')
+    parser.add_argument('--profile', help='JSON file to write timings and memory usage to')
+    args = parser.parse_args()
+
+    if args.profile:
+        instrument.enable()
+
+    with instrument.stage('load'):
+        store = CooccurrenceStore.load(args.store) if is_store(args.store) \
+            else CooccurrenceStore.empty()
+    for filename in args.json:
+        with instrument.stage('update'):
+            added = store.update(filename, args.batch_size)
+            instrument.record('added', added)
+        logging.info('Added {} recipes from {}'.format(added, filename))
+    logging.info('{} recipes, {} ingredients, {} co-occurring pairs'.format(
+        store.num_recipes, len(store.ingredients), store.num_pairs))
+    with instrument.stage('save'):
+        store.save(args.store)
+
+    if args.profile:
+        instrument.save(args.profile)
+
+if __name__ == '__main__':
+    main()
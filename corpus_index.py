@@ -0,0 +1,134 @@
+#!/usr/bin/env python
+
+import os
+import io
+import json
+import logging
+import argparse
+from collections import defaultdict, Counter
+
+import numpy as np
+
+import jsonl
+import preprocessing
+import instrument
+from split_data import parse_date
+
+class CorpusIndex(object):
+    """ What the corpus tools need from cookpad.json, extracted in a single pass.
+
+    Per recipe (in file order): id, report count, and publication date as
+    a date ordinal (0 if missing). Per normalized ingredient (sorted):
+    number of occurrences, and the sorted ids of the recipes using it,
+    stored as one concatenated array with offsets. """
+
+    def __init__(self, recipe_ids, report_counts, published_dates,
+                 ingredients, ingredient_counts, postings_indptr, postings):
+        self.recipe_ids = recipe_ids
+        self.report_counts = report_counts
+        self.published_dates = published_dates
+        self.ingredients = ingredients
+        self.ingredient_counts = ingredient_counts
+        self.postings_indptr = postings_indptr
+        self.postings = postings
+
+    FIELDS = ('id', 'report_count', 'published_date', 'ingredients')
+
+    @classmethod
+    def build(cls, filename):
+        recipe_ids, report_counts, published_dates = [], [], []
+        counts = Counter()
+        ingredient2recipes = defaultdict(set)
+
+        for recipe in jsonl.records(filename, cls.FIELDS):
+            instrument.count('records')
+            recipe_id = recipe['id']
+            recipe_ids.append(recipe_id)
+            report_counts.append(recipe.get('report_count', 0))
+            date = recipe.get('published_date')
+            published_dates.append(parse_date(date).toordinal() if date else 0)
+
+            ingredients = preprocessing.normalize_batch(recipe['ingredients'])
+            for normalized_ingredients in ingredients:
+                for normalized_ingredient in normalized_ingredients:
+                    counts[normalized_ingredient] += 1
+                    ingredient2recipes[normalized_ingredient].add(recipe_id)
+
+        ingredients = sorted(counts)
+        postings_indptr = np.zeros(len(ingredients) + 1, dtype=np.int64)
+        postings = []
+        for i, ingredient in enumerate(ingredients):
+            postings.extend(sorted(ingredient2recipes[ingredient]))
+            postings_indptr[i + 1] = len(postings)
+
+        return cls(np.array(recipe_ids, dtype=np.int64),
+                   np.array(report_counts, dtype=np.int32),
+                   np.array(published_dates, dtype=np.int32),
+                   ingredients,
+                   np.array([counts[ingredient] for ingredient in ingredients], dtype=np.int64),
+                   postings_indptr,
+                   np.array(postings, dtype=np.int64))
+
+    ARRAYS = ('recipe_ids', 'report_counts', 'published_dates', 'ingredient_counts',
+              'postings_indptr', 'postings')
+
+    def save(self, path):
+        if not os.path.isdir(path):
+            os.makedirs(path)
+        for name in self.ARRAYS:
+            np.save(os.path.join(path, name + '.npy'), getattr(self, name))
+        with io.open(os.path.join(path, 'ingredients.json'), 'w', encoding='utf8') as f:
+            f.write(unicode(json.dumps(self.ingredients, ensure_ascii=False)))
+
+    @classmethod
+    def load(cls, path, mmap_mode='r'):
+        arrays = dict((name, np.load(os.path.join(path, name + '.npy'), mmap_mode=mmap_mode))
+                      for name in cls.ARRAYS)
+        with io.open(os.path.join(path, 'ingredients.json'), encoding='utf8') as f:
+            ingredients = json.load(f)
+        return cls(ingredients=ingredients, **arrays)
+
+    @property
+    def num_recipes(self):
+        return len(self.recipe_ids)
+
+    def ingredient_counter(self):
+        """ Number of occurrences of every normalized ingredient """
+        return Counter(dict(zip(self.ingredients, self.ingredient_counts.tolist())))
+
+    def recipes(self, i):
+        """ Sorted ids of the recipes using the i-th ingredient """
+        return self.postings[self.postings_indptr[i]:self.postings_indptr[i + 1]]
+
+    def ingredient2recipes(self):
+        return dict((ingredient, self.recipes(i)) for i, ingredient in enumerate(self.ingredients))
+
+def is_index(path):
+    return os.path.isdir(path) and os.path.exists(os.path.join(path, 'ingredients.json'))
+
+def main():
+    logging.basicConfig(level=logging.INFO, format='%(message)s')
+
+    parser = argparse.ArgumentParser(description='Index the corpus for the inspect_* and '
+                                                 'generate_* tools')
+    parser.add_argument('json', help='Input data file')
+    parser.add_argument('index', help='Output index directory')
+    parser.add_argument('--profile', help='JSON file to write timings and memory usage to')
+    args = parser.parse_args()
+
+    if args.profile:
+        instrument.enable()
+
+    with instrument.stage('build'):
+        index = CorpusIndex.build(args.json)
+        instrument.record('ingredients', len(index.ingredients))
+    logging.info('Indexed {} recipes and {} ingredients'.format(index.num_recipes,
+                                                                len(index.ingredients)))
+    with instrument.stage('save'):
+        index.save(args.index)
+
+    if args.profile:
+        instrument.save(args.profile)
+
+if __name__ == '__main__':
+    main()
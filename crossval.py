@@ -0,0 +1,172 @@
+#!/usr/bin/env python
+
+import time
+import logging
+import multiprocessing
+from array import array
+
+import numpy as np
+import scipy.sparse as sp
+from sklearn.feature_extraction import DictVectorizer
+from sklearn.metrics import f1_score
+
+import sweep
+
+# Same as sweep._shared: the matrix is stored here before the worker pool
+# forks, and workers only receive (fold, regularization) pairs
+_shared = {}
+
+def vectorize(instances):
+    """ Returns a DictVectorizer fitted on instances and their matrix.
+
+    Unlike DictVectorizer.transform, features whose value is 0 are kept
+    as explicit zeros, so that document frequencies counted from the
+    structure of the matrix are the ones features.prune counts from the
+    keys of the dicts. """
+    vectorizer = DictVectorizer()
+    vectorizer.fit(instances)
+    vocabulary = vectorizer.vocabulary_
+
+    indices, data = array('i'), array('d')
+    indptr = np.zeros(len(instances) + 1, dtype=np.int64)
+    for i, instance in enumerate(instances):
+        for feature, value in instance.iteritems():
+            indices.append(vocabulary[feature])
+            data.append(value)
+        indptr[i + 1] = len(indices)
+    X = sp.csr_matrix((np.array(data, dtype=np.float64), np.array(indices, dtype=np.intc),
+                       indptr), shape=(len(instances), len(vocabulary)))
+    X.sort_indices()
+    return vectorizer, X
+
+def rows(X, start, end):
+    """ Rows start to end of a CSR matrix, built from slices of its arrays
+    rather than by fancy indexing """
+    indptr = X.indptr[start:end + 1] - X.indptr[start]
+    block = slice(X.indptr[start], X.indptr[end])
+    return sp.csr_matrix((X.data[block], X.indices[block], indptr),
+                         shape=(end - start, X.shape[1]), copy=False)
+
+def document_frequency(X, start=0, end=None):
+    """ Number of rows start to end of X in which each column is stored """
+    end = X.shape[0] if end is None else end
+    return np.bincount(X.indices[X.indptr[start]:X.indptr[end]], minlength=X.shape[1])
+
+def prune_mask(document_frequency, num_data, threshold):
+    """ Columns features.prune would keep, had it been run on the rows whose
+    document frequencies are given. Columns absent from those rows are
+    dropped too, as a DictVectorizer fitted on them would not know them. """
+    assert(len(threshold) == 2 and threshold[0] < threshold[1])
+    cutoffs = map(lambda threshold: int(threshold * num_data), threshold)
+    return ((document_frequency >= max(cutoffs[0], 1)) &
+            (document_frequency <= cutoffs[1]))
+
+def stratified_folds(y, k, seed=0):
+    """ Returns (permutation, bounds): permuting the rows by permutation
+    makes every fold a contiguous block, and bounds holds the (start, end)
+    row of each of the k folds. Every class is spread evenly over the folds. """
+    y = np.asarray(y)
+    random_state = np.random.RandomState(seed)
+    folds = [[] for _ in xrange(k)]
+    offset = 0
+    for label in np.unique(y):
+        members = np.flatnonzero(y == label)
+        random_state.shuffle(members)
+        for i, row in enumerate(members.tolist()):
+            folds[(offset + i) % k].append(row)
+        # the remainders of the classes go to different folds
+        offset += len(members)
+
+    permutation = np.concatenate([np.sort(np.array(fold, dtype=np.int64)) for fold in folds])
+    sizes = np.array([len(fold) for fold in folds])
+    ends = np.cumsum(sizes)
+    return permutation, zip((ends - sizes).tolist(), ends.tolist())
+
+def _fit_fold(task):
+    fold, regularization = task
+    X, y, bounds, columns = _shared['data']
+    start, end = bounds[fold]
+
+    start_time = time.time()
+    X_train = sp.vstack([rows(X, 0, start), rows(X, end, X.shape[0])], format='csr')
+    X_train = X_train[:, columns[fold]]
+    y_train = np.concatenate([y[:start], y[end:]])
+    model = sweep.make_model(regularization)
+    model.fit(X_train, y_train)
+
+    X_valid = rows(X, start, end)[:, columns[fold]]
+    score = f1_score(y[start:end], model.predict(X_valid))
+    return fold, regularization, score, time.time() - start_time
+
+class CrossValidation(object):
+    """ Stratified k-fold cross-validation on a single matrix.
+
+    The instances are permuted once, before being vectorized, so that every
+    fold is a contiguous block of rows, sliced out of the shared matrix by
+    the worker processes which fit it. The pruning of each fold is derived from the same matrix: the
+    document frequencies of a fold's training rows are those of all rows
+    minus those of its own rows. """
+
+    def __init__(self, instances, y, k=5, seed=0):
+        permutation, self.bounds = stratified_folds(y, k, seed)
+        self.y = np.asarray(y)[permutation]
+        self.vectorizer, self.X = vectorize([instances[i] for i in permutation.tolist()])
+        self.document_frequency = document_frequency(self.X)
+
+    def fold_columns(self, threshold):
+        columns = []
+        for start, end in self.bounds:
+            df = self.document_frequency - document_frequency(self.X, start, end)
+            mask = prune_mask(df, self.X.shape[0] - (end - start), threshold)
+            columns.append(np.flatnonzero(mask))
+        return columns
+
+    def run(self, grid=sweep.DEFAULT_GRID, jobs=1, threshold=[0.02, 0.98]):
+        """ Fits every fold with every regularization parameter in grid in
+        jobs worker processes. Returns a list of dicts with the mean and
+        standard deviation of the F1 score over the folds, and the mean
+        wall time per fit, for each parameter. """
+        tasks = [(fold, regularization) for regularization in grid
+                 for fold in xrange(len(self.bounds))]
+        _shared['data'] = (self.X, self.y, self.bounds, self.fold_columns(threshold))
+        try:
+            if jobs <= 1:
+                results = map(_fit_fold, tasks)
+            else:
+                pool = multiprocessing.Pool(jobs)
+                try:
+                    results = pool.map(_fit_fold, tasks)
+                    pool.close()
+                finally:
+                    pool.terminate()
+                    pool.join()
+        finally:
+            _shared.clear()
+
+        report = []
+        for regularization in grid:
+            scores = [score for fold, c, score, seconds in results if c == regularization]
+            seconds = [seconds for fold, c, score, seconds in results if c == regularization]
+            report.append({
+                'C': regularization,
+                'mean_f1': float(np.mean(scores)),
+                'stdev_f1': float(np.std(scores, ddof=1)) if len(scores) > 1 else 0.0,
+                'mean_fit_seconds': float(np.mean(seconds)),
+            })
+            logging.info('C={0}: F1 {1:.4f} +/- {2:.4f} over {3} folds, '
+                         '{4:.2f}s per fit'.format(regularization, report[-1]['mean_f1'],
+                                                   report[-1]['stdev_f1'], len(scores),
+                                                   report[-1]['mean_fit_seconds']))
+        return report
+
+    def fit(self, regularization, threshold=[0.02, 0.98]):
+        """ Fits a model on all rows, pruned as features.prune would, and
+        returns it with the vectorizer restricted to the kept features """
+        mask = prune_mask(self.document_frequency, self.X.shape[0], threshold)
+        model = sweep.make_model(regularization)
+        model.fit(self.X[:, np.flatnonzero(mask)], self.y)
+        self.vectorizer.restrict(mask)
+        return model, self.vectorizer
+
+def best_regularization(report):
+    return max(report, key=lambda result: result['mean_f1'])['C']
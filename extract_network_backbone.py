@@ -1,32 +1,58 @@
 #!/usr/bin/env python
 
 import argparse
-try:
-    import cPickle as pickle
-except:
-    import pickle
 
+import numpy as np
 import networkx as nx
-import scipy.integrate
-
-def extract_backbone(g, alpha):
-    backbone_graph = nx.Graph()
-    for node in g:
-        k_n = len(g[node])
-        if k_n > 1:
-            sum_w = sum(g[node][neighbor]['weight'] for neighbor in g[node])
-            for neighbor in g[node]:
-                edge_weight = g[node][neighbor]['weight']
-                pij = float(edge_weight) / sum_w
-                f = lambda x: (1-x)**(k_n-2)
-                alpha_ij =  1 - (k_n-1) * scipy.integrate.quad(f, 0, pij)[0]
-                if alpha_ij < alpha:
-                    backbone_graph.add_edge(node, neighbor, weight=edge_weight)
-
-                    # copy over node attributes
-                    backbone_graph.node[node]['num_recipes'] = g.node[node]['num_recipes']
-                    backbone_graph.node[neighbor]['num_recipes'] = g.node[neighbor]['num_recipes']
-    return backbone_graph
+
+import instrument
+from compact_graph import CompactGraph, load_graph, save_graph
+
+RULES = ('either', 'both')
+
+def disparity_significance(u, v, w, num_nodes):
+    """ Disparity filter significance of every edge, as seen from each endpoint.
+
+    For a node of degree k, an edge carrying a fraction p of its strength has
+    alpha = 1 - (k - 1) * integral_0^p (1 - x)^(k - 2) dx = (1 - p)^(k - 1).
+    Nodes of degree one cannot judge their edge, which gets alpha = inf. """
+    strength = (np.bincount(u, weights=w, minlength=num_nodes) +
+                np.bincount(v, weights=w, minlength=num_nodes))
+    degree = np.bincount(u, minlength=num_nodes) + np.bincount(v, minlength=num_nodes)
+
+    def significance(node):
+        k = degree[node]
+        alpha = np.power(1 - w / strength[node], k - 1)
+        alpha[k <= 1] = np.inf
+        return alpha
+
+    return significance(u), significance(v)
+
+def backbone_mask(alpha_u, alpha_v, alpha, rule='either'):
+    """ Edges kept at the given alpha, if they are significant for
+    either or both of their endpoints """
+    if rule == 'either':
+        return (alpha_u < alpha) | (alpha_v < alpha)
+    elif rule == 'both':
+        return (alpha_u < alpha) & (alpha_v < alpha)
+    raise ValueError('Unknown rule: {}'.format(rule))
+
+def extract_backbones(graph, alphas, rule='either'):
+    """ Yields (alpha, backbone graph) for every alpha, computing the
+    significance of the edges only once """
+    if not isinstance(graph, CompactGraph):
+        graph = CompactGraph.from_networkx(graph)
+    u, v, w = graph.edges()
+    w = w.astype(np.float64)
+    alpha_u, alpha_v = disparity_significance(u, v, w, len(graph))
+    for alpha in alphas:
+        mask = backbone_mask(alpha_u, alpha_v, alpha, rule)
+        yield alpha, CompactGraph.from_edges(graph.nodes, u[mask], v[mask], w[mask],
+                                             graph.num_recipes)
+
+def extract_backbone(graph, alpha, rule='either'):
+    for _, backbone_graph in extract_backbones(graph, [alpha], rule):
+        return backbone_graph
 
 def extract_backbone2(g, alpha):
     g2 = nx.Graph()
@@ -40,15 +66,35 @@ def extract_backbone2(g, alpha):
 
 def main():
     parser = argparse.ArgumentParser(description='Extract the backbone of the network')
-    parser.add_argument('in_gml', help='Input network gml file')
-    parser.add_argument('out_gexf', help='Output network gexf file')
-    parser.add_argument('--alpha', help='alpha', type=float, default=0.01)
+    parser.add_argument('network', help='Input network directory (or network pkl file)')
+    parser.add_argument('out', help='Output network gexf file (or network directory). When '
+                                    'several alphas are given, {alpha} is replaced by each '
+                                    'of them')
+    parser.add_argument('--alpha', help='alpha', type=float, nargs='+', default=[0.01])
+    parser.add_argument('--rule', choices=RULES, default='either',
+                        help='Keep edges significant for either or both of their endpoints')
+    parser.add_argument('--profile', help='JSON file to write timings and memory usage to')
     args = parser.parse_args()
 
-    with open(args.in_gml) as f:
-        graph = pickle.load(f)
-    backbone_graph = extract_backbone(graph, args.alpha)
-    nx.write_gexf(backbone_graph, args.out_gexf, encoding='utf-8')
+    if len(args.alpha) > 1 and '{alpha}' not in args.out:
+        parser.error('out must contain {alpha} when several alphas are given')
+
+    if args.profile:
+        instrument.enable()
+
+    with instrument.stage('load'):
+        graph = load_graph(args.network)
+
+    backbones = extract_backbones(graph, args.alpha, args.rule)
+    for alpha in args.alpha:
+        with instrument.stage('alpha={0}'.format(alpha)):
+            _, backbone_graph = next(backbones)
+            instrument.record('nodes', len(backbone_graph))
+            instrument.record('edges', len(backbone_graph.indices) // 2)
+            save_graph(backbone_graph, args.out.format(alpha=alpha))
+
+    if args.profile:
+        instrument.save(args.profile)
 
 if __name__ == '__main__':
     main()
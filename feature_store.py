@@ -0,0 +1,188 @@
+#!/usr/bin/env python
+
+import json
+import sqlite3
+import hashlib
+import logging
+import argparse
+from array import array
+
+import jsonl
+import features
+
+# bytes hashed at the start of a data file and right before the read offset
+FINGERPRINT_WINDOW = 1 << 20
+
+class FeatureStore(object):
+    """ Extracted features of the recipes of one JSONL file, kept in sqlite.
+
+    Every recipe is stored with its feature ids and a hash of its JSON line,
+    and the store remembers how far into the file it has read, and sha1s of
+    the first and last FINGERPRINT_WINDOW bytes read. update only reads what
+    was appended since, and only extracts recipes which are new or whose
+    content changed, so MeCab and normalization never run twice on the same
+    recipe. A file which got shorter than the read part, or whose fingerprint
+    changed, e.g. one rewritten by split_data.py, is extracted again from
+    scratch. Checking the fingerprint costs two windows of I/O rather than a
+    re-read of the whole file, so a rewrite which only changes bytes between
+    the two windows goes unnoticed. """
+
+    def __init__(self, filename):
+        self.filename = filename
+        self.db = sqlite3.connect(filename)
+        self.db.executescript('''
+            CREATE TABLE IF NOT EXISTS features
+                (id INTEGER PRIMARY KEY, name TEXT UNIQUE, kind TEXT);
+            CREATE TABLE IF NOT EXISTS recipes
+                (recipe_id INTEGER PRIMARY KEY, position INTEGER, hash BLOB,
+                 label INTEGER, feature_ids BLOB, feature_values BLOB);
+            CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT);
+        ''')
+        self.db.commit()
+
+        self.feature_ids = {}
+        self.feature_names = {}
+        self.feature_kinds = {}
+        for feature_id, name, kind in self.db.execute('SELECT id, name, kind FROM features'):
+            self.feature_ids[name] = feature_id
+            self.feature_names[feature_id] = name
+            self.feature_kinds[feature_id] = kind
+
+    def get_meta(self, key, default=None):
+        row = self.db.execute('SELECT value FROM meta WHERE key = ?', (key,)).fetchone()
+        return json.loads(row[0]) if row else default
+
+    def set_meta(self, key, value):
+        self.db.execute('INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)',
+                        (key, json.dumps(value)))
+
+    def intern(self, key):
+        name = ':'.join(key)
+        feature_id = self.feature_ids.get(name)
+        if feature_id is None:
+            feature_id = len(self.feature_ids)
+            self.db.execute('INSERT INTO features (id, name, kind) VALUES (?, ?, ?)',
+                            (feature_id, name, key[0]))
+            self.feature_ids[name] = feature_id
+            self.feature_names[feature_id] = name
+            self.feature_kinds[feature_id] = key[0]
+        return feature_id
+
+    def reset(self):
+        self.db.execute('DELETE FROM recipes')
+        self.set_meta('offset', 0)
+        self.set_meta('fingerprint', None)
+        self.db.commit()
+
+    def fingerprint(self, json_filename, offset, window=FINGERPRINT_WINDOW):
+        """ sha1s of the first window bytes of json_filename and of the window
+        bytes before offset, or None if the file is shorter than offset """
+        with open(json_filename, 'rb') as f:
+            head = f.read(min(window, offset))
+            f.seek(max(0, offset - window))
+            tail = f.read(min(window, offset))
+        if len(tail) < min(window, offset):
+            return None
+        return [hashlib.sha1(head).hexdigest(), hashlib.sha1(tail).hexdigest()]
+
+    def save_progress(self, json_filename, offset):
+        self.set_meta('offset', offset)
+        self.set_meta('fingerprint', self.fingerprint(json_filename, offset))
+        self.db.commit()
+
+    def update(self, json_filename, commit_every=1000):
+        """ Extracts the recipes appended to json_filename since the last
+        update. Returns (number of lines read, number of recipes extracted). """
+        if jsonl.is_compressed(json_filename):
+            raise ValueError('{} is compressed, but feature stores resume reading from '
+                             'a byte offset of an uncompressed file'.format(json_filename))
+        offset = self.get_meta('offset', 0)
+        if offset and self.fingerprint(json_filename, offset) != self.get_meta('fingerprint'):
+            logging.info('{} was rewritten, rebuilding the feature store'.format(
+                json_filename))
+            self.reset()
+            offset = 0
+
+        num_read, num_extracted = 0, 0
+        next_position = self.db.execute('SELECT COALESCE(MAX(position) + 1, 0) '
+                                        'FROM recipes').fetchone()[0]
+        with open(json_filename) as f:
+            f.seek(offset)
+            for line in iter(f.readline, ''):
+                if not line.endswith('\n'):
+                    # still being written by the crawler, read it next time
+                    break
+                num_read += 1
+                digest = hashlib.sha1(line.strip()).digest()
+                recipe = json.loads(line.strip())
+                row = self.db.execute('SELECT position, hash FROM recipes WHERE recipe_id = ?',
+                                      (recipe['id'],)).fetchone()
+                if row is not None and bytes(row[1]) == digest:
+                    offset = f.tell()
+                    continue
+
+                if row is not None:
+                    position = row[0]
+                else:
+                    position = next_position
+                    next_position += 1
+
+                feature_vector, label = features.extract_recipe(recipe)
+                feature_ids = array('i', (self.intern(key) for key in feature_vector))
+                feature_values = array('i', feature_vector.itervalues())
+                self.db.execute('INSERT OR REPLACE INTO recipes VALUES (?, ?, ?, ?, ?, ?)',
+                                (recipe['id'], position, sqlite3.Binary(digest), label,
+                                 sqlite3.Binary(feature_ids.tostring()),
+                                 sqlite3.Binary(feature_values.tostring())))
+                num_extracted += 1
+
+                offset = f.tell()
+                if num_extracted % commit_every == 0:
+                    self.save_progress(json_filename, offset)
+
+        self.save_progress(json_filename, offset)
+        return num_read, num_extracted
+
+    def instances(self, mask=None):
+        """ Yields (dict of feature name to value, label) in file order,
+        like features.filter(features.extract(...)) followed by todict """
+        for label, ids, values in self.db.execute('SELECT label, feature_ids, feature_values '
+                                                  'FROM recipes ORDER BY position'):
+            feature_ids = array('i')
+            feature_ids.fromstring(bytes(ids))
+            feature_values = array('i')
+            feature_values.fromstring(bytes(values))
+            yield dict((self.feature_names[i], v) for i, v in zip(feature_ids, feature_values)
+                       if mask is None or self.feature_kinds[i] in mask), label
+
+    def dataset(self, mask=None):
+        X, y = [], []
+        for instance, label in self.instances(mask):
+            X.append(instance)
+            y.append(label)
+        return X, y
+
+    def __len__(self):
+        return self.db.execute('SELECT COUNT(*) FROM recipes').fetchone()[0]
+
+    def close(self):
+        self.db.commit()
+        self.db.close()
+
+def main():
+    logging.basicConfig(level=logging.INFO, format='%(message)s')
+
+    parser = argparse.ArgumentParser(description='Extract features of newly crawled recipes '
+                                                 'into a feature store')
+    parser.add_argument('json', help='Input data file')
+    parser.add_argument('store', help='Feature store sqlite file')
+    args = parser.parse_args()
+
+    store = FeatureStore(args.store)
+    num_read, num_extracted = store.update(args.json)
+    logging.info('Read {} new lines, extracted {} recipes, {} recipes in store'.format(
+        num_read, num_extracted, len(store)))
+    store.close()
+
+if __name__ == '__main__':
+    main()
@@ -3,11 +3,16 @@
 
 from collections import deque, Counter
 import re
-import json
+import hashlib
+import threading
+import multiprocessing
 
 import MeCab
 
 import preprocessing
+import cache
+import jsonl
+import instrument
 
 STOP_WORDS = set([u'話題', u'入り', u'題入り', u'話', u'話題入り',
                   u'祝', u'感謝', u'有難', u'', u'ありが', u'がとう',
@@ -22,7 +27,16 @@ class FeatureVector(dict):
                 yield ':'.join(fname), fval
         return dict(kv())
 
-mecab = MeCab.Tagger("-Owakati")
+MECAB_OPTIONS = "-Owakati"
+
+mecab = MeCab.Tagger(MECAB_OPTIONS)
+
+# taggers are not thread safe, so threads other than the main one
+# parse with their own, see use_thread_tagger
+_local = threading.local()
+
+# optional cache.PersistentCache of MeCab output, see use_token_cache
+token_cache = None
 
 def is_number(s):
     try:
@@ -31,34 +45,131 @@ def is_number(s):
     except ValueError:
         return False
 
-def tokenize(s):
-    string = s.encode("utf-8")
-    output = mecab.parse(string)
-    tokens = output.decode('utf8')
-    for token in tokens.strip().split(' '):
-        if is_number(token):
-            yield u'<NUM>'
-        else:
-            yield token
-
-def _ngrams(tokens):
-    """ N-gram features """
-    ngram = deque(maxlen=3)
-    for token in tokens:
-        ngram.append(token)
-        yield (1, token)
-        if len(ngram) >= 2:
-            yield (2, '%s %s' % (ngram[-2], ngram[-1]))
-        if len(ngram) == 3:
-            yield (3, ' '.join(ngram))
+def tagger_signature():
+    """ Identifies the MeCab dictionary and options, so that cached output
+    is invalidated when either of them changes """
+    try:
+        info = mecab.dictionary_info()
+        dictionary = '{}:{}:{}'.format(info.filename, info.version, info.size)
+    except AttributeError:
+        dictionary = ''
+    return '{}|{}'.format(MECAB_OPTIONS, dictionary)
+
+def use_token_cache(filename, maxsize=100000):
+    global token_cache, _signature
+    token_cache = cache.PersistentCache(filename, maxsize=maxsize)
+    _signature = tagger_signature()
+    return token_cache
+
+def use_thread_tagger():
+    """ Gives the calling thread a MeCab tagger of its own """
+    _local.mecab = MeCab.Tagger(MECAB_OPTIONS)
+
+def parse(string):
+    tagger = getattr(_local, 'mecab', mecab)
+    if token_cache is None:
+        return tagger.parse(string)
+
+    key = hashlib.sha1(_signature + '\0' + string).digest()
+    output = token_cache.get(key)
+    if output is None:
+        output = tagger.parse(string)
+        token_cache.set(key, output)
+    return output
+
+class TokenVocabulary(object):
+    """ Interns MeCab tokens as integer ids, so that n-grams are built and
+    checked against STOP_WORDS as tuples of ids, and only n-grams which are
+    kept are turned into strings. Ids are local to the process, which is
+    why features are still keyed by strings. Numbers all share the id of
+    <NUM>, and are not kept as tokens of their own. """
+
+    def __init__(self, max_ngrams=100000):
+        self.ids = {}
+        self.tokens = []
+        self.stop = []
+        self.max_ngrams = max_ngrams
+        self.ngram_strings = {}
+        self.lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.tokens)
+
+    def intern(self, token):
+        i = self.ids.get(token)
+        if i is None:
+            if is_number(token):
+                token = u'<NUM>'
+                i = self.ids.get(token)
+                if i is not None:
+                    return i
+            with self.lock:
+                i = self._add(token)
+        return i
+
+    def _add(self, token):
+        i = self.ids.get(token)
+        if i is None:
+            i = len(self.tokens)
+            self.tokens.append(token)
+            # the same test ngrams used to run on every n-gram string
+            self.stop.append(not STOP_WORDS.isdisjoint(token.split()))
+            # published last, for threads reading without the lock
+            self.ids[token] = i
+        return i
+
+    def ngram_string(self, ngram):
+        if len(ngram) == 1:
+            return self.tokens[ngram[0]]
+        string = self.ngram_strings.get(ngram)
+        if string is None:
+            if len(self.ngram_strings) >= self.max_ngrams:
+                self.ngram_strings.clear()
+            string = u' '.join([self.tokens[i] for i in ngram])
+            self.ngram_strings[ngram] = string
+        return string
+
+# the vocabulary is replaced by an empty one once it holds this many tokens,
+# so that long-running processes meeting ever new words stay bounded
+MAX_TOKENS = 1 << 19
+
+vocabulary = TokenVocabulary()
+
+def current_vocabulary():
+    """ The vocabulary to intern the tokens of the next string into. Callers
+    keep using the one they got, since replacing it invalidates all ids. """
+    global vocabulary
+    if len(vocabulary) >= MAX_TOKENS:
+        vocabulary = TokenVocabulary()
+    return vocabulary
+
+def token_ids(s, vocabulary=None):
+    """ Returns the MeCab tokens of s as ids interned into vocabulary,
+    with numbers replaced by <NUM> """
+    if vocabulary is None:
+        vocabulary = current_vocabulary()
+    output = parse(s.encode("utf-8")).decode('utf8')
+    intern = vocabulary.intern
+    return [intern(token) for token in output.strip().split(' ')]
+
+def ngram_ids(string, vocabulary):
+    """ Yields (n, tuple of token ids) for the n-grams of string
+    which contain no stop word """
+    ids = token_ids(string, vocabulary)
+    stop = [vocabulary.stop[i] for i in ids]
+    for k, i in enumerate(ids):
+        if not stop[k]:
+            yield 1, (i,)
+            if k >= 1 and not stop[k - 1]:
+                yield 2, (ids[k - 1], i)
+                if k >= 2 and not stop[k - 2]:
+                    yield 3, (ids[k - 2], ids[k - 1], i)
 
 def ngrams(string):
-    tokens = tokenize(string)
-    for (c, w) in _ngrams(tokens):
-        words = set(w.split())
-        if words & STOP_WORDS:
-            continue
-        yield (c, w)
+    vocabulary = current_vocabulary()
+    ngram_string = vocabulary.ngram_string
+    for (c, ngram) in ngram_ids(string, vocabulary):
+        yield (c, ngram_string(ngram))
 
 def description(recipe):
     desc = recipe['description']
@@ -67,8 +178,7 @@ def description(recipe):
 
 def ingredients(recipe):
     ingredientz = recipe['ingredients']
-    for ingredient in ingredientz:
-        normalized_ingredients = preprocessing.normalize(ingredient)
+    for normalized_ingredients in preprocessing.normalize_batch(ingredientz):
         for normalized_ingredient in normalized_ingredients:
             yield ('meta', 'ingr', normalized_ingredient)
 
@@ -102,31 +212,126 @@ def has_main_image(recipe):
     key = 'image_main'
     return int(key in recipe and len(recipe[key]) > 0)
 
+def text_features(recipe):
+    """ Yields the (feature, value) pairs which need MeCab """
+    for ngram in description(recipe):
+        yield ngram, 1
+    for ngram in title(recipe):
+        yield ngram, 1
+    # for ngram in history(recipe):
+    #     yield ngram, 1
+    # for ngram in advice(recipe):
+    #     yield ngram, 1
+
+def recipe_features(recipe, text=None):
+    """ Yields (feature, value) pairs without building a FeatureVector.
+    text may hold the text_features of recipe, if already extracted. """
+    for ingredient in ingredients(recipe):
+        yield ingredient, 1
+    # for category in categories(recipe):
+    #     yield category, 1
+    for feature in (text_features(recipe) if text is None else text):
+        yield feature
+
+    yield author(recipe), 1
+    yield ('meta', 'inst_img'), has_instruction_images(recipe)
+    yield ('meta', 'main_img'), has_main_image(recipe)
+
+def recipe_label(recipe):
+    return recipe['label'] if 'label' in recipe else 0
+
+def extract_recipe(recipe, text=None):
+    return FeatureVector(recipe_features(recipe, text)), recipe_label(recipe)
+
 def extract(filename):
-    with open(filename) as f:
-        for line in f:
-            recipe = json.loads(line.strip())
-            features = FeatureVector()
-
-            for ingredient in ingredients(recipe):
-                features[ingredient] = 1
-            # for category in categories(recipe):
-            #     features[category] = 1
-            for ngram in description(recipe):
-                features[ngram] = 1
-            for ngram in title(recipe):
-                features[ngram] = 1
-            # for ngram in history(recipe):
-            #     features[ngram] = 1
-            # for ngram in advice(recipe):
-            #     features[ngram] = 1
-
-            features[author(recipe)] = 1
-            features[('meta', 'inst_img')] = has_instruction_images(recipe)
-            features[('meta', 'main_img')] = has_main_image(recipe)
-
-            label = recipe['label'] if 'label' in recipe else 0
-            yield features, label
+    for recipe in jsonl.records(filename):
+        instrument.count('records')
+        yield extract_recipe(recipe)
+
+def init_worker(cache_args=None, memo_args=None):
+    """ Pool initializer which gives the worker process its own MeCab tagger,
+    and opens the token cache and normalization memo given by the
+    (filename, maxsize) tuples cache_args and memo_args, if any """
+    # MeCab taggers and sqlite connections are not safe to share across
+    # processes, so every worker builds its own
+    global mecab
+    mecab = MeCab.Tagger(MECAB_OPTIONS)
+    if cache_args is not None:
+        use_token_cache(*cache_args)
+    if memo_args is not None:
+        preprocessing.use_memo(*memo_args)
+
+def _run_chunk(task):
+    func, args, chunk = task
+    lines = chunk.read() if isinstance(chunk, jsonl.Range) else chunk
+    result = func(lines, *args)
+    preprocessing.memo.flush()
+    if token_cache is None:
+        return result, None
+    token_cache.flush()
+    return result, token_cache.stats(reset=True)
+
+def map_lines(func, filename, jobs, chunk_size=1000, args=()):
+    """ Calls func(lines, *args) on consecutive chunks of lines of filename
+    in a pool of worker processes, and yields the results in input order.
+    func must be a module-level function so that it can be pickled.
+    Workers read their own chunks of uncompressed files, see jsonl.chunks. """
+    if jobs <= 1:
+        f = jsonl.open_file(filename)
+        try:
+            for lines in jsonl.line_chunks(jsonl.read_lines(f), chunk_size):
+                yield func(lines, *args)
+        finally:
+            f.close()
+        return
+
+    cache_args = None
+    if token_cache is not None:
+        token_cache.flush()
+        cache_args = (token_cache.filename, token_cache.maxsize)
+    memo_args = None
+    if preprocessing.memo.filename is not None:
+        preprocessing.memo.flush()
+        memo_args = (preprocessing.memo.filename, preprocessing.memo.maxsize)
+
+    def collect(pending_result):
+        result, stats = pending_result.get()
+        if stats is not None:
+            token_cache.merge_stats(stats)
+        return result
+
+    pool = multiprocessing.Pool(jobs, initializer=init_worker,
+                                initargs=(cache_args, memo_args))
+    try:
+        # only a few chunks are kept in flight, so that memory does not
+        # grow with the size of the file
+        pending = deque()
+        for chunk in jsonl.chunks(filename, chunk_size):
+            pending.append(pool.apply_async(_run_chunk, ((func, args, chunk),)))
+            if len(pending) >= 2 * jobs:
+                yield collect(pending.popleft())
+        while pending:
+            yield collect(pending.popleft())
+        pool.close()
+    finally:
+        pool.terminate()
+        pool.join()
+
+def _extract_lines(lines):
+    return [extract_recipe(jsonl.decode(line)) for line in lines]
+
+def extract_parallel(filename, jobs, chunk_size=1000):
+    """ Same as extract, but spreads the work over a pool of worker processes.
+    Instances are yielded in input order. """
+    if jobs <= 1:
+        for instance in extract(filename):
+            yield instance
+        return
+
+    for instances in map_lines(_extract_lines, filename, jobs, chunk_size):
+        instrument.count('records', len(instances))
+        for instance in instances:
+            yield instance
 
 def filter(stream, mask):
     for features, label in stream:
@@ -146,6 +351,8 @@ def prune(instances, threshold=[0.02, 0.98]):
 
     valid_features = set(f for f in feature_counts if feature_counts[f] >= cutoffs[0] and
                                                       feature_counts[f] <= cutoffs[1])
+    instrument.record('features_before_prune', len(feature_counts))
+    instrument.record('features_after_prune', len(valid_features))
 
     for instance in instances:
         for feature in instance.keys():
@@ -2,32 +2,34 @@
 
 import sys
 import argparse
-import json
 from collections import Counter
 try:
     import cPickle as pickle
 except:
     import pickle
 
+import jsonl
 import preprocessing
+import corpus_index
 
 def main():
     parser = argparse.ArgumentParser(description='Generate an ingredient-ID mapping file')
-    parser.add_argument('json', help='Input data file')
+    parser.add_argument('json', help='Input data file or corpus index directory')
     parser.add_argument('--threshold', type=int, default=5,
                         help='Cutoff of how many times an ingredient should occur in recipes',)
     parser.add_argument('pkl', help='Output pickle file')
     args = parser.parse_args()
 
-    ingredients_counter = Counter()
+    if corpus_index.is_index(args.json):
+        ingredients_counter = corpus_index.CorpusIndex.load(args.json).ingredient_counter()
+    else:
+        ingredients_counter = Counter()
 
-    with open(args.json, 'r') as f:
-        for line in f:
-            recipe = json.loads(line.strip())
+        for recipe in jsonl.records(args.json, ['ingredients']):
             ingredients = recipe['ingredients']
 
-            for ingredient in ingredients:
-                for normalized_ingredient in preprocessing.normalize(ingredient):
+            for normalized_ingredients in preprocessing.normalize_batch(ingredients):
+                for normalized_ingredient in normalized_ingredients:
                     ingredients_counter[normalized_ingredient] += 1
 
     ingredient_id = 0
@@ -1,9 +1,7 @@
 #!/usr/bin/env python
 
 import sys
-import json
 import argparse
-import itertools
 import math
 from collections import defaultdict
 try:
@@ -11,73 +9,144 @@ try:
 except:
     import pickle
 
-import networkx as nx
+import numpy as np
 
+import jsonl
 import preprocessing
+import corpus_index
+import instrument
+from cooccurrence import CooccurrenceStore, incidence_matrix, cooccurrences, is_store
+from compact_graph import CompactGraph, save_graph
 
 def load_ingredient2recipes(filename):
+    """ Returns the ids of the recipes using each normalized ingredient,
+    and the number of recipes read """
+    if corpus_index.is_index(filename):
+        index = corpus_index.CorpusIndex.load(filename)
+        return index.ingredient2recipes(), index.num_recipes
+
     ingredient2recipes = defaultdict(set)
-    with open(filename, 'r') as f:
-        for line in f:
-            recipe = json.loads(line.strip())
-            recipe_id = recipe['id']
-            ingredients = recipe['ingredients']
-            for ingredient in ingredients:
-                for normalized_ingredient in preprocessing.normalize(ingredient):
-                    ingredient2recipes[normalized_ingredient].add(recipe_id)
-    return ingredient2recipes
+    num_recipes = 0
+    for recipe in jsonl.records(filename, ['id', 'ingredients']):
+        instrument.count('records')
+        num_recipes += 1
+        recipe_id = recipe['id']
+        ingredients = recipe['ingredients']
+        for normalized_ingredients in preprocessing.normalize_batch(ingredients):
+            for normalized_ingredient in normalized_ingredients:
+                ingredient2recipes[normalized_ingredient].add(recipe_id)
+    return ingredient2recipes, num_recipes
+
+def pmi_values(pair_counts, counts_a, counts_b, num_recipes):
+    numerator = pair_counts.astype(np.int64) * num_recipes
+    denominator = counts_a.astype(np.int64) * counts_b.astype(np.int64)
+    return numerator.astype(np.float64) / denominator
+
+def log_values(pmis):
+    # math.log rather than np.log, which may differ in the last bit
+    return np.array([math.log(pmi) for pmi in pmis.tolist()], dtype=np.float64)
+
+def pmi_edges(ingredient2recipes, valid_ingredients, num_recipes, use_log=False):
+    """ Returns (ingredients, recipe_counts, a, b, pmis), where a and b index
+    into ingredients, for every pair of valid ingredients which co-occur in
+    some recipe. Co-occurrences are counted with a single sparse product,
+    so the cost depends on the number of co-occurring pairs rather than
+    on the square of the vocabulary size. """
+    ingredients = [ingredient for ingredient in ingredient2recipes
+                   if ingredient in valid_ingredients]
+    incidence = incidence_matrix(ingredient2recipes, ingredients)
+    recipe_counts = np.asarray(incidence.sum(axis=0)).ravel()
+
+    a, b, pair_counts = cooccurrences(incidence)
+    pmis = pmi_values(pair_counts, recipe_counts[a], recipe_counts[b], num_recipes)
+    if use_log:
+        pmis = log_values(pmis)
+    return ingredients, recipe_counts, a, b, pmis
+
+def store_pmi_edges(store, valid_ingredients, num_recipes=None, use_log=False):
+    """ Same as pmi_edges, from the counts of a CooccurrenceStore, in time
+    linear in the number of stored pairs. num_recipes defaults to the
+    number of recipes counted by the store. """
+    if num_recipes is None:
+        num_recipes = store.num_recipes
+    valid = np.array([ingredient in valid_ingredients for ingredient in store.ingredients],
+                     dtype=bool)
+    ingredients = [ingredient for ingredient, keep in zip(store.ingredients, valid) if keep]
+    recipe_counts = np.asarray(store.ingredient_counts)[valid]
+
+    new_index = np.cumsum(valid) - 1
+    keep = valid[store.pair_a] & valid[store.pair_b]
+    a, b = new_index[store.pair_a[keep]], new_index[store.pair_b[keep]]
+    pmis = pmi_values(store.pair_counts[keep], recipe_counts[a], recipe_counts[b], num_recipes)
+    if use_log:
+        pmis = log_values(pmis)
+    return ingredients, recipe_counts, a, b, pmis
 
 def calc_pmis(ingredient2recipes, valid_ingredients, num_recipes, use_log=False):
-    for a, b in itertools.combinations(ingredient2recipes.iterkeys(), 2):
-        if not a in valid_ingredients or not b in valid_ingredients:
-            continue
-
-        numerator = len(ingredient2recipes[a] & ingredient2recipes[b]) * num_recipes
-        if numerator == 0:
-            continue
-
-        denominator = len(ingredient2recipes[a]) * len(ingredient2recipes[b])
-
-        pmi = float(numerator) / denominator
-        if use_log:
-            pmi = math.log(pmi)
-
-        yield a, b, pmi
+    """ Yields (a, b, pmi) for every pair of valid ingredients which
+    co-occur in some recipe """
+    ingredients, _, a, b, pmis = pmi_edges(ingredient2recipes, valid_ingredients,
+                                           num_recipes, use_log)
+    for i, j, pmi in zip(a.tolist(), b.tolist(), pmis.tolist()):
+        yield ingredients[i], ingredients[j], pmi
 
 def main():
     parser = argparse.ArgumentParser(description='Generate ingredient complement network')
-    parser.add_argument('json', help='Input data file')
+    parser.add_argument('json', help='Input data file, corpus index directory, '
+                                     'or co-occurrence store directory')
     parser.add_argument('mapping', help='Input ingredient-ID mapping file')
-    parser.add_argument('pkl', help='Output network pkl file')
-    parser.add_argument('--num_recipes', help='Number of recipes', type=int, default=47884)
+    parser.add_argument('network', help='Output network directory '
+                                        '(or network pkl/gexf file)')
+    parser.add_argument('--num_recipes', type=int,
+                        help='Number of recipes (default: the number of recipes read)')
     parser.add_argument('--histo', help='Output PMI histogram file')
     parser.add_argument('--log', action='store_true', help='Use log for calculating PMI',
                         default=False)
+    parser.add_argument('--profile', help='JSON file to write timings and memory usage to')
     args = parser.parse_args()
 
+    if args.profile:
+        instrument.enable()
+
     with open(args.mapping, 'r') as f:
         ingredient2id = pickle.load(f)['ingredient2id']
     valid_ingredients = set(ingredient2id.iterkeys())
 
-    ingredient2recipes = load_ingredient2recipes(args.json)
-
-    graph = nx.Graph()
-    pmis = []
-    for a, b, pmi in calc_pmis(ingredient2recipes, valid_ingredients, args.num_recipes, args.log):
-        graph.add_edge(a, b, weight=pmi)
-        graph.node[a]['num_recipes'] = len(ingredient2recipes[a])
-        graph.node[b]['num_recipes'] = len(ingredient2recipes[b])
-        pmis.append(pmi)
-        # print '{}\t{}\t{}\t{}\t{}'.format(pmi, a.encode('utf8'), b.encode('utf8'),
-        #                                   len(ingredient2recipes[a]), len(ingredient2recipes[b]))
-
-    with open(args.pkl, 'w') as f:
-        pickle.dump(graph, f)
+    if is_store(args.json):
+        with instrument.stage('load'):
+            store = CooccurrenceStore.load(args.json)
+            instrument.record('ingredients', len(store.ingredients))
+            instrument.record('pairs', store.num_pairs)
+
+        with instrument.stage('pmi'):
+            ingredients, recipe_counts, a, b, pmis = store_pmi_edges(store, valid_ingredients,
+                                                                     args.num_recipes, args.log)
+            instrument.record('nodes', len(ingredients))
+            instrument.record('edges', len(a))
+    else:
+        with instrument.stage('load'):
+            ingredient2recipes, num_recipes = load_ingredient2recipes(args.json)
+            instrument.record('ingredients', len(ingredient2recipes))
+        if args.num_recipes is not None:
+            num_recipes = args.num_recipes
+
+        with instrument.stage('pmi'):
+            ingredients, recipe_counts, a, b, pmis = pmi_edges(ingredient2recipes,
+                                                               valid_ingredients,
+                                                               num_recipes, args.log)
+            instrument.record('nodes', len(ingredients))
+            instrument.record('edges', len(a))
+    with instrument.stage('save'):
+        graph = CompactGraph.from_edges(ingredients, a, b, pmis, recipe_counts)
+        save_graph(graph, args.network)
 
     if args.histo:
         import pylab as pl
         n, bins, patches = pl.hist(pmis, bins=1000)
         pl.savefig(args.histo)
 
+    if args.profile:
+        instrument.save(args.profile)
+
 if __name__ == '__main__':
     main()
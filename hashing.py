@@ -0,0 +1,137 @@
+#!/usr/bin/env python
+
+from array import array
+
+import numpy as np
+import scipy.sparse as sp
+from sklearn.utils import murmurhash3_32
+
+import jsonl
+import features
+import instrument
+
+DEFAULT_N_FEATURES = 2 ** 20
+
+def _asarray(buf, dtype):
+    # view the array.array buffer without copying it
+    if len(buf) == 0:
+        return np.zeros(0, dtype=dtype)
+    return np.frombuffer(buf, dtype=dtype)
+
+def feature_index(name, n_features):
+    if isinstance(name, unicode):
+        name = name.encode('utf8')
+    return murmurhash3_32(name, positive=True) % n_features
+
+class HashedVectorizer(object):
+    """ Maps features into a fixed-size space by hashing their names.
+
+    Rows are streamed straight into CSR arrays, so neither FeatureVector
+    dicts nor a vocabulary have to be kept in memory. Pruning is done
+    afterwards with a document-frequency mask over the hashed columns. """
+
+    def __init__(self, n_features=DEFAULT_N_FEATURES, mask=None):
+        self.n_features = n_features
+        self.mask = mask
+        self.column_mask_ = None
+
+    def transform_stream(self, stream):
+        """ stream yields (iterable of (feature tuple, value), label) pairs """
+        indices = array('i')
+        data = array('d')
+        indptr = array('i', [0])
+        labels = array('i')
+        for pairs, label in stream:
+            for key, value in pairs:
+                if self.mask is not None and key[0] not in self.mask:
+                    continue
+                indices.append(feature_index(':'.join(key), self.n_features))
+                data.append(value)
+            indptr.append(len(indices))
+            labels.append(label)
+
+        X = self._csr(indices, data, indptr, len(labels))
+        return self.prune(X), _asarray(labels, np.intc)
+
+    def transform(self, X):
+        """ Same as DictVectorizer.transform, for dicts with joined feature names """
+        indices = array('i')
+        data = array('d')
+        indptr = array('i', [0])
+        for instance in X:
+            for name, value in instance.iteritems():
+                indices.append(feature_index(name, self.n_features))
+                data.append(value)
+            indptr.append(len(indices))
+        return self.prune(self._csr(indices, data, indptr, len(indptr) - 1))
+
+    def _csr(self, indices, data, indptr, num_rows):
+        X = sp.csr_matrix((_asarray(data, np.float64),
+                           _asarray(indices, np.intc),
+                           _asarray(indptr, np.intc)),
+                          shape=(num_rows, self.n_features))
+        # a feature repeated within a recipe, or two features colliding,
+        # must still count as a single binary feature
+        X.sum_duplicates()
+        np.minimum(X.data, 1, out=X.data)
+        return X
+
+    def fit_prune(self, X, threshold=[0.02, 0.98]):
+        """ Vectorized equivalent of features.prune on a hashed matrix """
+        self.fit_document_frequency(self.document_frequency(X), X.shape[0], threshold)
+        return self.prune(X)
+
+    def document_frequency(self, X):
+        return np.bincount(X.indices, minlength=self.n_features)
+
+    def fit_document_frequency(self, document_frequency, num_data, threshold=[0.02, 0.98]):
+        """ Sets the column mask from document frequencies counted elsewhere,
+        e.g. over minibatches in a pre-pass """
+        assert(len(threshold) == 2 and threshold[0] < threshold[1])
+        cutoffs = map(lambda threshold: int(threshold * num_data), threshold)
+        self.column_mask_ = ((document_frequency >= cutoffs[0]) &
+                             (document_frequency <= cutoffs[1]))
+        instrument.record('features_before_prune', int(np.count_nonzero(document_frequency)))
+        instrument.record('features_after_prune',
+                          int(np.count_nonzero(self.column_mask_ & (document_frequency > 0))))
+
+    def prune(self, X):
+        if self.column_mask_ is None:
+            return X
+        keep = self.column_mask_[X.indices]
+        rows = np.repeat(np.arange(X.shape[0]), np.diff(X.indptr))
+        row_counts = np.bincount(rows[keep], minlength=X.shape[0])
+        indptr = np.concatenate([[0], np.cumsum(row_counts)]).astype(X.indptr.dtype)
+        return sp.csr_matrix((X.data[keep], X.indices[keep], indptr), shape=X.shape)
+
+    def inverse_transform(self, X):
+        """ Hashed features cannot be named, so columns are reported by index """
+        X = sp.csr_matrix(X)
+        instances = []
+        for i in xrange(X.shape[0]):
+            row = slice(X.indptr[i], X.indptr[i + 1])
+            instances.append(dict(('#{}'.format(j), v)
+                                  for j, v in zip(X.indices[row], X.data[row])))
+        return instances
+
+def transform_lines(lines, vectorizer):
+    """ Vectorizes a chunk of JSONL lines, e.g. in a features.map_lines worker """
+    def stream():
+        for line in lines:
+            recipe = jsonl.decode(line)
+            yield features.recipe_features(recipe), features.recipe_label(recipe)
+    return vectorizer.transform_stream(stream())
+
+def transform_file(vectorizer, filename, jobs=1, chunk_size=1000):
+    # workers get a vectorizer without the column mask, which is applied
+    # once to the assembled matrix instead of being pickled with every chunk
+    unpruned = HashedVectorizer(vectorizer.n_features, vectorizer.mask)
+    matrices, labels = [], []
+    for X, y in features.map_lines(transform_lines, filename, jobs, chunk_size,
+                                   args=(unpruned,)):
+        instrument.count('records', X.shape[0])
+        matrices.append(X)
+        labels.append(y)
+    if not matrices:
+        return sp.csr_matrix((0, vectorizer.n_features)), np.zeros(0, dtype=np.intc)
+    return vectorizer.prune(sp.vstack(matrices, format='csr')), np.concatenate(labels)
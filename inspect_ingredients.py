@@ -1,26 +1,28 @@
 #!/usr/bin/env python
 
-import json
 import argparse
 from collections import Counter
 
+import jsonl
 import preprocessing
+import corpus_index
 
 def main():
     parser = argparse.ArgumentParser(description='Inspect top n ingredients')
-    parser.add_argument('json', help='Input data file')
+    parser.add_argument('json', help='Input data file or corpus index directory')
     parser.add_argument('--n', help='Number of ingredients to print', type=int, default=1000)
     args = parser.parse_args()
 
-    ingredients_counter = Counter()
+    if corpus_index.is_index(args.json):
+        ingredients_counter = corpus_index.CorpusIndex.load(args.json).ingredient_counter()
+    else:
+        ingredients_counter = Counter()
 
-    with open(args.json, 'r') as f:
-        for line in f:
-            recipe = json.loads(line.strip())
+        for recipe in jsonl.records(args.json, ['ingredients']):
             ingredients = recipe['ingredients']
 
-            for ingredient in ingredients:
-                for normalized_ingredient in preprocessing.normalize(ingredient):
+            for normalized_ingredients in preprocessing.normalize_batch(ingredients):
+                for normalized_ingredient in normalized_ingredients:
                     ingredients_counter[normalized_ingredient] += 1
 
     for ingredient, count in ingredients_counter.most_common(args.n):
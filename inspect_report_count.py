@@ -1,23 +1,26 @@
 #!/usr/bin/env python
 
 import argparse
-import json
 
 import pylab as pl
 
-def load_data(filename):
-    with open(filename, 'r') as f:
-        for line in f:
-            yield json.loads(line.strip())
+import jsonl
+import corpus_index
+
+def load_data(filename, fields=None):
+    return jsonl.records(filename, fields)
 
 def main():
     parser = argparse.ArgumentParser(description='Inspect report count distribution')
-    parser.add_argument('json', help='Input data file')
+    parser.add_argument('json', help='Input data file or corpus index directory')
     parser.add_argument('png', help='Output histogram plot file')
     parser.add_argument('--xmax', help='Max x', type=int, default=200)
     args = parser.parse_args()
 
-    report_counts = map(lambda d: d['report_count'], load_data(args.json))
+    if corpus_index.is_index(args.json):
+        report_counts = corpus_index.CorpusIndex.load(args.json).report_counts
+    else:
+        report_counts = map(lambda d: d['report_count'], load_data(args.json, ['report_count']))
     n, bins, patches = pl.hist(report_counts, bins=100, range=(0, args.xmax))
     pl.savefig(args.png)
 
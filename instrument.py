@@ -0,0 +1,154 @@
+#!/usr/bin/env python
+
+import sys
+import json
+import time
+import logging
+import platform
+import resource
+
+def _cpu_seconds(who):
+    usage = resource.getrusage(who)
+    return usage.ru_utime + usage.ru_stime
+
+def _peak_rss_mb(who):
+    rss = resource.getrusage(who).ru_maxrss
+    # ru_maxrss is in kilobytes on Linux, but in bytes on OS X
+    if sys.platform == 'darwin':
+        return rss / (1024.0 * 1024.0)
+    return rss / 1024.0
+
+class Stage(object):
+    """ Wall time, CPU time of this process and of the worker processes
+    reaped meanwhile, peak RSS, and any values recorded while it runs """
+
+    def __init__(self, profiler, name):
+        self.profiler = profiler
+        self.name = name
+        self.values = {}
+
+    def __enter__(self):
+        self.profiler.active.append(self)
+        self.profiler.stages.append(self)
+        self.start = time.time()
+        self.cpu_start = _cpu_seconds(resource.RUSAGE_SELF)
+        self.children_cpu_start = _cpu_seconds(resource.RUSAGE_CHILDREN)
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.wall_seconds = time.time() - self.start
+        self.cpu_seconds = _cpu_seconds(resource.RUSAGE_SELF) - self.cpu_start
+        self.children_cpu_seconds = (_cpu_seconds(resource.RUSAGE_CHILDREN) -
+                                     self.children_cpu_start)
+        self.peak_rss_mb = _peak_rss_mb(resource.RUSAGE_SELF)
+        self.profiler.active.pop()
+        logging.info('[profile] {0}: {1:.2f}s wall, {2:.2f}s CPU, {3:.2f}s worker CPU, '
+                     '{4:.0f}MB peak RSS'.format(self.name, self.wall_seconds,
+                                                 self.cpu_seconds, self.children_cpu_seconds,
+                                                 self.peak_rss_mb))
+        return False
+
+    def record(self, key, value):
+        self.values[key] = value
+
+    def count(self, key, n=1):
+        self.values[key] = self.values.get(key, 0) + n
+
+    def report(self):
+        report = dict(self.values)
+        report.update({
+            'name': self.name,
+            'wall_seconds': self.wall_seconds,
+            'cpu_seconds': self.cpu_seconds,
+            'children_cpu_seconds': self.children_cpu_seconds,
+            'peak_rss_mb': self.peak_rss_mb,
+        })
+        if 'records' in self.values and self.wall_seconds > 0:
+            report['records_per_second'] = self.values['records'] / self.wall_seconds
+        return report
+
+class _NullStage(object):
+    """ What stage returns while profiling is disabled """
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        return False
+
+    def record(self, key, value):
+        pass
+
+    def count(self, key, n=1):
+        pass
+
+_null_stage = _NullStage()
+
+class Profiler(object):
+    def __init__(self):
+        self.enabled = False
+        self.stages = []
+        self.active = []
+
+    def enable(self):
+        self.enabled = True
+        self.start = time.time()
+
+    def stage(self, name):
+        if not self.enabled:
+            return _null_stage
+        if self.active:
+            name = '{0}/{1}'.format(self.active[-1].name, name)
+        return Stage(self, name)
+
+    def current(self):
+        if not self.enabled or not self.active:
+            return _null_stage
+        return self.active[-1]
+
+    def report(self):
+        return {
+            'argv': sys.argv,
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'wall_seconds': time.time() - self.start,
+            'cpu_seconds': _cpu_seconds(resource.RUSAGE_SELF),
+            'children_cpu_seconds': _cpu_seconds(resource.RUSAGE_CHILDREN),
+            'peak_rss_mb': _peak_rss_mb(resource.RUSAGE_SELF),
+            'children_peak_rss_mb': _peak_rss_mb(resource.RUSAGE_CHILDREN),
+            'stages': [stage.report() for stage in self.stages if not stage in self.active],
+        }
+
+    def save(self, filename):
+        with open(filename, 'w') as f:
+            json.dump(self.report(), f, indent=2, sort_keys=True)
+
+# disabled until enable is called, so that instrumented code costs
+# a function call and an attribute lookup per stage or value
+profiler = Profiler()
+
+def enable():
+    profiler.enable()
+
+def stage(name):
+    """ Context manager measuring a stage of the pipeline. Stages nest,
+    and nested stage names are prefixed with the enclosing one's. """
+    return profiler.stage(name)
+
+def record(key, value):
+    """ Records a value in the innermost running stage """
+    profiler.current().record(key, value)
+
+def count(key, n=1):
+    """ Adds n to a counter of the innermost running stage """
+    profiler.current().count(key, n)
+
+def record_matrix(X):
+    """ Records the shape and number of stored values of a sparse matrix """
+    current = profiler.current()
+    current.record('rows', X.shape[0])
+    current.record('columns', X.shape[1])
+    current.record('nnz', X.nnz)
+
+def save(filename):
+    profiler.save(filename)
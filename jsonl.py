@@ -0,0 +1,133 @@
+#!/usr/bin/env python
+
+import bz2
+import gzip
+import json
+try:
+    import lzma
+except ImportError:
+    try:
+        from backports import lzma
+    except ImportError:
+        lzma = None
+
+BUFFER_SIZE = 1 << 20
+
+COMPRESSED = ('.gz', '.bz2', '.xz')
+
+def is_compressed(filename):
+    return filename.endswith(COMPRESSED)
+
+def open_file(filename):
+    """ Opens a data file for reading, decompressing .gz, .bz2 and .xz
+    files on the fly """
+    if filename.endswith('.gz'):
+        return gzip.open(filename, 'rb')
+    if filename.endswith('.bz2'):
+        return bz2.BZ2File(filename, 'rb')
+    if filename.endswith('.xz'):
+        if lzma is None:
+            raise ImportError('reading .xz files requires the lzma module '
+                              '(pip install backports.lzma)')
+        return lzma.LZMAFile(filename, 'rb')
+    return open(filename, 'rb')
+
+def read_lines(f, buffer_size=BUFFER_SIZE):
+    """ Yields the lines of f without their newline, reading buffer_size
+    bytes at a time, which is much faster than iterating over a
+    decompressing file object """
+    rest = ''
+    while True:
+        block = f.read(buffer_size)
+        if not block:
+            break
+        lines = (rest + block).split('\n')
+        rest = lines.pop()
+        for line in lines:
+            yield line
+    if rest:
+        yield rest
+
+def line_chunks(lines, chunk_size):
+    """ Groups lines into lists of chunk_size lines """
+    chunk = []
+    for line in lines:
+        chunk.append(line)
+        if len(chunk) >= chunk_size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+def decode(line, fields=None):
+    """ Decodes a recipe, keeping only the given fields if any """
+    recipe = json.loads(line.strip())
+    if fields is None:
+        return recipe
+    return dict((field, recipe[field]) for field in fields if field in recipe)
+
+def records(filename, fields=None):
+    """ Yields the recipes of a possibly compressed JSONL file """
+    f = open_file(filename)
+    try:
+        for line in read_lines(f):
+            yield decode(line, fields)
+    finally:
+        f.close()
+
+class Range(object):
+    """ Lines of an uncompressed file between two byte offsets, which
+    a worker process can read by itself instead of being sent them """
+
+    def __init__(self, filename, start, end):
+        self.filename = filename
+        self.start = start
+        self.end = end
+
+    def read(self):
+        with open(self.filename, 'rb') as f:
+            f.seek(self.start)
+            data = f.read(self.end - self.start)
+        lines = data.split('\n')
+        if not lines[-1]:
+            lines.pop()
+        return lines
+
+def line_ranges(filename, chunk_size, buffer_size=BUFFER_SIZE):
+    """ Yields (start, end) byte offsets of consecutive chunks of chunk_size
+    lines of an uncompressed file. Only newlines are looked for, nothing
+    is decoded. """
+    start, offset, count = 0, 0, 0
+    with open(filename, 'rb') as f:
+        while True:
+            block = f.read(buffer_size)
+            if not block:
+                break
+            position = 0
+            newlines = block.count('\n')
+            while newlines >= chunk_size - count:
+                for _ in xrange(chunk_size - count):
+                    position = block.index('\n', position) + 1
+                newlines -= chunk_size - count
+                yield start, offset + position
+                start, count = offset + position, 0
+            count += newlines
+            offset += len(block)
+    if offset > start:
+        yield start, offset
+
+def chunks(filename, chunk_size):
+    """ Yields consecutive chunks of chunk_size lines of filename to be
+    handed to worker processes: Range objects for uncompressed files,
+    lists of lines for compressed ones, which cannot be seeked into """
+    if is_compressed(filename):
+        f = open_file(filename)
+        try:
+            for lines in line_chunks(read_lines(f), chunk_size):
+                yield lines
+        finally:
+            f.close()
+        return
+
+    for start, end in line_ranges(filename, chunk_size):
+        yield Range(filename, start, end)
@@ -0,0 +1,105 @@
+#!/usr/bin/env python
+
+import os
+import json
+import shutil
+import hashlib
+import tempfile
+try:
+    import cPickle as pickle
+except:
+    import pickle
+
+import numpy as np
+import scipy.sparse as sp
+from sklearn.feature_extraction import DictVectorizer
+
+def file_digest(filename, block_size=1 << 20):
+    sha1 = hashlib.sha1()
+    with open(filename, 'rb') as f:
+        for block in iter(lambda: f.read(block_size), b''):
+            sha1.update(block)
+    return sha1.hexdigest()
+
+class MatrixCache(object):
+    """ Directory of feature matrices, one subdirectory per cache key.
+    Every CSR matrix is stored as three .npy arrays so that it can be
+    loaded back through memory mapping without copying. """
+
+    def __init__(self, directory):
+        self.directory = directory
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+
+    def key(self, filenames, mask, threshold, **params):
+        sha1 = hashlib.sha1()
+        for filename in filenames:
+            sha1.update(file_digest(filename))
+        sha1.update(json.dumps({'mask': sorted(mask),
+                                'threshold': list(threshold),
+                                'params': params}, sort_keys=True))
+        return sha1.hexdigest()
+
+    def path(self, key):
+        return os.path.join(self.directory, key)
+
+    def __contains__(self, key):
+        return os.path.exists(os.path.join(self.path(key), 'meta.json'))
+
+    def save(self, key, vectorizer, datasets):
+        # write into a temporary directory first so that an interrupted
+        # run never leaves a half written entry behind
+        tmp = tempfile.mkdtemp(dir=self.directory)
+        try:
+            meta = {'datasets': {}}
+            for name, (X, y) in datasets.iteritems():
+                X = sp.csr_matrix(X)
+                np.save(os.path.join(tmp, name + '.data.npy'), X.data)
+                np.save(os.path.join(tmp, name + '.indices.npy'), X.indices)
+                np.save(os.path.join(tmp, name + '.indptr.npy'), X.indptr)
+                np.save(os.path.join(tmp, name + '.labels.npy'), np.asarray(y))
+                meta['datasets'][name] = {'shape': list(X.shape)}
+
+            if isinstance(vectorizer, DictVectorizer):
+                with open(os.path.join(tmp, 'vocabulary.json'), 'w') as f:
+                    json.dump(vectorizer.feature_names_, f)
+            else:
+                with open(os.path.join(tmp, 'vectorizer.pkl'), 'wb') as f:
+                    pickle.dump(vectorizer, f, pickle.HIGHEST_PROTOCOL)
+            with open(os.path.join(tmp, 'meta.json'), 'w') as f:
+                json.dump(meta, f)
+
+            if key in self:
+                shutil.rmtree(self.path(key))
+            os.rename(tmp, self.path(key))
+        except:
+            shutil.rmtree(tmp, ignore_errors=True)
+            raise
+
+    def load(self, key):
+        path = self.path(key)
+        with open(os.path.join(path, 'meta.json')) as f:
+            meta = json.load(f)
+
+        def load_array(name):
+            return np.load(os.path.join(path, name + '.npy'), mmap_mode='r')
+
+        datasets = {}
+        for name, info in meta['datasets'].iteritems():
+            X = sp.csr_matrix((load_array(name + '.data'),
+                               load_array(name + '.indices'),
+                               load_array(name + '.indptr')),
+                              shape=tuple(info['shape']), copy=False)
+            datasets[name] = (X, load_array(name + '.labels'))
+
+        if os.path.exists(os.path.join(path, 'vectorizer.pkl')):
+            with open(os.path.join(path, 'vectorizer.pkl'), 'rb') as f:
+                return pickle.load(f), datasets
+
+        with open(os.path.join(path, 'vocabulary.json')) as f:
+            feature_names = json.load(f)
+        vectorizer = DictVectorizer()
+        vectorizer.feature_names_ = feature_names
+        vectorizer.vocabulary_ = dict((f, i) for i, f in enumerate(feature_names))
+
+        return vectorizer, datasets
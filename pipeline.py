@@ -0,0 +1,240 @@
+#!/usr/bin/env python
+
+import sys
+import time
+import Queue
+import logging
+import argparse
+import threading
+
+import jsonl
+import features
+import instrument
+
+class _Failure(object):
+    """ An exception raised by a stage, passed down to the consumer """
+
+    def __init__(self, exc_info):
+        self.exc_info = exc_info
+
+_DONE = object()
+
+class Stage(object):
+    """ Threads applying func to the chunks of the input queue, and putting
+    the results on the output queue. init, if given, is called once in every
+    thread before it starts working. """
+
+    def __init__(self, name, func, threads=1, init=None):
+        self.name = name
+        self.func = func
+        self.threads = threads
+        self.init = init
+        self.input = None
+        self.output = None
+        self.chunks = 0
+        self.busy = 0.0
+        self.depth_sum = 0
+        self.depth_max = 0
+        self.lock = threading.Lock()
+        self.running = threads
+
+    def observe(self, depth, busy):
+        with self.lock:
+            self.chunks += 1
+            self.busy += busy
+            self.depth_sum += depth
+            self.depth_max = max(self.depth_max, depth)
+
+    def run(self, stopped):
+        try:
+            if self.init is not None:
+                self.init()
+            while True:
+                depth = self.input.qsize()
+                item = self.input.get()
+                if item is _DONE or stopped.is_set():
+                    # let the other threads of this stage see it too
+                    self.input.put(_DONE)
+                    return
+                seq, chunk = item
+                start = time.time()
+                if not isinstance(chunk, _Failure):
+                    try:
+                        chunk = self.func(chunk)
+                    except Exception:
+                        chunk = _Failure(sys.exc_info())
+                self.observe(depth, time.time() - start)
+                self.output.put((seq, chunk))
+        finally:
+            with self.lock:
+                self.running -= 1
+                last = self.running == 0
+            if last:
+                self.output.put(_DONE)
+
+    def stats(self, elapsed):
+        return {
+            'threads': self.threads,
+            'chunks': self.chunks,
+            'utilization': self.busy / (self.threads * elapsed) if elapsed > 0 else None,
+            'mean_queue_depth': float(self.depth_sum) / self.chunks if self.chunks else 0.0,
+            'max_queue_depth': self.depth_max,
+        }
+
+def _unblock(queue):
+    """ Empties queue, and wakes up a thread waiting on it """
+    try:
+        while True:
+            queue.get_nowait()
+    except Queue.Empty:
+        pass
+    try:
+        queue.put_nowait(_DONE)
+    except Queue.Full:
+        pass
+
+class Pipeline(object):
+    """ Runs stages concurrently, connected by bounded queues of queue_size
+    chunks, so that a slow stage blocks the ones before it instead of
+    letting memory grow. Results are yielded in the order of the input.
+
+    The mean depth of the input queue of each stage shows where the
+    bottleneck is: the slowest stage has a full input queue, and the
+    ones after it have empty ones. """
+
+    def __init__(self, stages, queue_size=8):
+        self.stages = stages
+        self.queue_size = queue_size
+
+    def run(self, chunks):
+        stopped = threading.Event()
+        queues = [Queue.Queue(self.queue_size) for _ in xrange(len(self.stages) + 1)]
+        for stage, source, sink in zip(self.stages, queues, queues[1:]):
+            stage.input, stage.output = source, sink
+        reader = Stage('read', None)
+        reader.output = queues[0]
+
+        def read():
+            seq = 0
+            try:
+                start = time.time()
+                for chunk in chunks:
+                    if stopped.is_set():
+                        break
+                    reader.observe(0, time.time() - start)
+                    reader.output.put((seq, chunk))
+                    seq += 1
+                    start = time.time()
+            except Exception:
+                reader.output.put((seq, _Failure(sys.exc_info())))
+            reader.output.put(_DONE)
+
+        threads = [threading.Thread(target=read)]
+        for stage in self.stages:
+            threads.extend(threading.Thread(target=stage.run, args=(stopped,))
+                           for _ in xrange(stage.threads))
+        for thread in threads:
+            thread.daemon = True
+            thread.start()
+
+        start = time.time()
+        consumer = Stage('consume', None)
+        consumer.input = queues[-1]
+        pending = {}
+        next_seq = 0
+        try:
+            while True:
+                depth = consumer.input.qsize()
+                item = consumer.input.get()
+                if item is _DONE:
+                    break
+                seq, chunk = item
+                pending[seq] = chunk
+                while next_seq in pending:
+                    chunk = pending.pop(next_seq)
+                    next_seq += 1
+                    if isinstance(chunk, _Failure):
+                        exc_type, exc_value, traceback = chunk.exc_info
+                        raise exc_type, exc_value, traceback
+                    consume_start = time.time()
+                    yield chunk
+                    consumer.observe(depth, time.time() - consume_start)
+        finally:
+            elapsed = time.time() - start
+            # queues are not waited on with timeouts, which are slow in Python 2,
+            # so threads still blocked on one are woken up instead
+            stopped.set()
+            while any(thread.is_alive() for thread in threads):
+                for queue in queues:
+                    _unblock(queue)
+                for thread in threads:
+                    thread.join(0.01)
+            self.report(reader, consumer, elapsed)
+
+    def report(self, reader, consumer, elapsed):
+        stats = {}
+        for stage in [reader] + self.stages + [consumer]:
+            stats[stage.name] = stage.stats(elapsed)
+            logging.info('[pipeline] {0}: {1} chunks, {2} threads, {3:.0%} busy, '
+                         'queue depth {4:.1f} mean, {5} max'.format(
+                             stage.name, stage.chunks, stage.threads,
+                             stats[stage.name]['utilization'] or 0.0,
+                             stats[stage.name]['mean_queue_depth'],
+                             stats[stage.name]['max_queue_depth']))
+        instrument.record('pipeline', stats)
+        return stats
+
+def _decode(lines):
+    return [jsonl.decode(line) for line in lines]
+
+def _tokenize(recipes):
+    return [(recipe, list(features.text_features(recipe))) for recipe in recipes]
+
+def _vectorize(tokenized):
+    return [features.extract_recipe(recipe, text) for recipe, text in tokenized]
+
+def extract_pipelined(filename, decode_threads=1, tokenize_threads=1, chunk_size=100,
+                      queue_size=8, block_size=jsonl.BUFFER_SIZE):
+    """ Same as features.extract, with reading, JSON decoding, tokenization
+    and vectorization running concurrently in threads. Tokenizing threads
+    use their own MeCab tagger. Normalization and the assembly of the
+    feature vectors stay in a single thread, as the normalization memo
+    is not thread safe. """
+    stages = [Stage('decode', _decode, decode_threads),
+              Stage('tokenize', _tokenize, tokenize_threads, init=features.use_thread_tagger),
+              Stage('vectorize', _vectorize)]
+    f = jsonl.open_file(filename)
+    try:
+        chunks = jsonl.line_chunks(jsonl.read_lines(f, block_size), chunk_size)
+        for instances in Pipeline(stages, queue_size).run(chunks):
+            instrument.count('records', len(instances))
+            for instance in instances:
+                yield instance
+    finally:
+        f.close()
+
+def main():
+    logging.basicConfig(level=logging.INFO, format='%(message)s')
+
+    parser = argparse.ArgumentParser(description='Extract features with the threaded '
+                                                 'pipeline and report its queue depths')
+    parser.add_argument('json', help='Input data file')
+    parser.add_argument('--decode_threads', type=int, default=1)
+    parser.add_argument('--tokenize_threads', type=int, default=1)
+    parser.add_argument('--chunk_size', type=int, default=100,
+                        help='Number of recipes passed between stages at once')
+    parser.add_argument('--queue_size', type=int, default=8,
+                        help='Number of chunks each queue holds')
+    args = parser.parse_args()
+
+    num_recipes = 0
+    start = time.time()
+    for instance in extract_pipelined(args.json, args.decode_threads, args.tokenize_threads,
+                                      args.chunk_size, args.queue_size):
+        num_recipes += 1
+    elapsed = time.time() - start
+    logging.info('Extracted {0} recipes in {1:.2f}s ({2:.0f} recipes/s)'.format(
+        num_recipes, elapsed, num_recipes / elapsed if elapsed > 0 else 0.0))
+
+if __name__ == '__main__':
+    main()
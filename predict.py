@@ -0,0 +1,125 @@
+#!/usr/bin/env python
+
+import os
+import json
+import logging
+import argparse
+import multiprocessing
+from collections import deque
+
+import jsonl
+import features
+from serve import Scorer
+
+_scorer = None
+
+def _init_worker(model_file):
+    global _scorer
+    features.init_worker()
+    _scorer = Scorer.load(model_file)
+
+def score_lines(lines, scorer=None):
+    """ Returns the output rows for a chunk of JSONL lines """
+    scorer = scorer or _scorer
+    recipes = [jsonl.decode(line) for line in lines]
+    probabilities = scorer.score(recipes)
+    return ''.join('{}\t{}\n'.format(recipe['id'], probability)
+                   for recipe, probability in zip(recipes, probabilities.tolist()))
+
+def read_chunks(f, chunk_size):
+    """ Yields (lines, end offset) for consecutive chunks of f """
+    while True:
+        lines = []
+        while len(lines) < chunk_size:
+            line = f.readline()
+            if not line:
+                break
+            lines.append(line)
+        if not lines:
+            return
+        yield lines, f.tell()
+
+class Checkpoint(object):
+    """ Offsets into the input and output files up to which scoring is done """
+
+    def __init__(self, filename):
+        self.filename = filename
+
+    def load(self):
+        if not os.path.exists(self.filename):
+            return 0, 0
+        with open(self.filename) as f:
+            offsets = json.load(f)
+        return offsets['input'], offsets['output']
+
+    def save(self, input_offset, output_offset):
+        tmp = self.filename + '.tmp'
+        with open(tmp, 'w') as f:
+            json.dump({'input': input_offset, 'output': output_offset}, f)
+        os.rename(tmp, self.filename)
+
+def predict(model_file, input_file, output_file, jobs=1, chunk_size=1000, resume=False):
+    checkpoint = Checkpoint(output_file + '.checkpoint')
+    input_offset, output_offset = checkpoint.load() if resume else (0, 0)
+    if input_offset:
+        logging.info('Resuming from byte {}'.format(input_offset))
+
+    out = open(output_file, 'r+' if input_offset else 'w')
+    out.seek(output_offset)
+    out.truncate()
+
+    def write(rows, end):
+        out.write(rows)
+        out.flush()
+        checkpoint.save(end, out.tell())
+
+    with jsonl.open_file(input_file) as f:
+        f.seek(input_offset)
+        chunks = read_chunks(f, chunk_size)
+        try:
+            if jobs <= 1:
+                features.init_worker()
+                scorer = Scorer.load(model_file)
+                for lines, end in chunks:
+                    write(score_lines(lines, scorer), end)
+                return
+
+            pool = multiprocessing.Pool(jobs, initializer=_init_worker, initargs=(model_file,))
+            try:
+                # chunks are written in input order, and only a few of them
+                # are in flight at any time to keep memory bounded
+                pending = deque()
+                for lines, end in chunks:
+                    pending.append((pool.apply_async(score_lines, (lines,)), end))
+                    if len(pending) >= 2 * jobs:
+                        result, end = pending.popleft()
+                        write(result.get(), end)
+                while pending:
+                    result, end = pending.popleft()
+                    write(result.get(), end)
+                pool.close()
+            finally:
+                pool.terminate()
+                pool.join()
+        finally:
+            out.close()
+
+def main():
+    logging.basicConfig(level=logging.INFO, format='%(message)s')
+
+    parser = argparse.ArgumentParser(description='Score a JSONL file of recipes with a '
+                                                 'model pickled by classify.py')
+    parser.add_argument('model', help='Pickled model file')
+    parser.add_argument('json', help='Input data file')
+    parser.add_argument('output', help='Output file of tab-separated id and probability')
+    parser.add_argument('--jobs', type=int, default=1, help='Number of worker processes')
+    parser.add_argument('--chunk_size', type=int, default=1000,
+                        help='Number of recipes scored per task')
+    parser.add_argument('--resume', action='store_true',
+                        help='Continue from the checkpoint of an interrupted run')
+    args = parser.parse_args()
+
+    predict(args.model, args.json, args.output, args.jobs, args.chunk_size, args.resume)
+
+if __name__ == '__main__':
+    main()
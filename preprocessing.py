@@ -2,8 +2,12 @@
 # -*- coding: utf-8 -*-
 
 import re
+import json
+import hashlib
 import zenhan
 
+import cache
+
 SURROUNDS = (
     re.compile(ur'\(.*\).*'),
     re.compile(ur'\(.*\）.*'),
@@ -40,6 +44,30 @@ SPECIAL_SYMBOLS = (
     re.compile(ur'[\uff00-\uffef]'),         # halfwidth and fullwdith forms
 )
 
+# bump whenever normalize changes in a way its patterns do not show,
+# so that persistent memos stop returning the old normalizations
+NORMALIZE_VERSION = 1
+
+def make_symbol_table():
+    """ unicode.translate table deleting every character matched by
+    SPECIAL_SYMBOLS, so that they can be stripped in a single pass """
+    ranges = (
+        (0x002a, 0x002a),  # *
+        (0x0040, 0x0040),  # @
+        (0x007c, 0x007c),  # | (part of the cjk symbols character class)
+        (0x2000, 0x206f),
+        (0x2460, 0x24ff),
+        (0x2500, 0x257f),
+        (0x25a0, 0x25ff),
+        (0x2600, 0x26ff),
+        (0x2700, 0x27bf),
+        (0x3000, 0x3000),
+        (0x3002, 0x303f),
+        (0xff00, 0xffef),
+    )
+    return dict((c, None) for start, end in ranges for c in xrange(start, end + 1))
+SPECIAL_SYMBOLS_TABLE = make_symbol_table()
+
 def make_function_hiragana():
     re_katakana = re.compile(ur'[ァ-ヴ]')
     def hiragana(text):
@@ -70,8 +98,7 @@ def normalize(ingredient):
     if match and not ingredient.startswith('S&B'):
         ingredient = match.groups()[0]
 
-    for SPECIAL_SYMBOL in SPECIAL_SYMBOLS:
-        ingredient = SPECIAL_SYMBOL.sub(lambda s: '', ingredient)
+    ingredient = ingredient.translate(SPECIAL_SYMBOLS_TABLE)
 
     ingredients = SPLIT.split(ingredient)
     ingredients = map(lambda ingr: ENDS_WITH.sub(lambda s: '', ingr), ingredients)
@@ -81,6 +108,79 @@ def normalize(ingredient):
     for ingredient in ingredients:
         yield ingredient
 
+def rules_signature():
+    """ Identifies the normalization rules, so that memoized
+    normalizations are invalidated when they change """
+    regexes = SURROUNDS + (UNCLOSED_PAREN, STARTS_WITH_ALPHA, ENDS_WITH, SPLIT,
+                           OPTIONAL_START)
+    patterns = [regex.pattern for regex in regexes]
+    rules = json.dumps([NORMALIZE_VERSION, patterns, sorted(SPECIAL_SYMBOLS_TABLE)])
+    return hashlib.sha1(rules).hexdigest()
+
+class NormalizeMemo(object):
+    """ Bounded memo of raw -> normalized ingredients, optionally backed
+    by a sqlite file which can be shared by several processes. Keys of
+    the sqlite file include the signature of the normalization rules. """
+
+    def __init__(self, maxsize=100000, filename=None):
+        self.maxsize = maxsize
+        self.filename = filename
+        self.memory = cache.LRUCache(maxsize)
+        self.store = None
+        if filename is not None:
+            self.store = cache.PersistentCache(filename, maxsize=0)
+            self.signature = rules_signature()
+
+    def key(self, ingredient):
+        return hashlib.sha1(self.signature + '\0' + ingredient.encode('utf8')).digest()
+
+    def get(self, ingredient):
+        normalized = self.memory.get(ingredient)
+        if normalized is not None or self.store is None:
+            return normalized
+
+        value = self.store.get(self.key(ingredient))
+        if value is not None:
+            normalized = tuple(json.loads(value))
+            self.memory[ingredient] = normalized
+        return normalized
+
+    def set(self, ingredient, normalized):
+        self.memory[ingredient] = normalized
+        if self.store is not None:
+            self.store.set(self.key(ingredient), json.dumps(normalized))
+
+    def flush(self):
+        if self.store is not None:
+            self.store.flush()
+
+    def close(self):
+        if self.store is not None:
+            self.store.close()
+
+memo = NormalizeMemo()
+
+def use_memo(filename, maxsize=100000):
+    """ Makes normalize_batch memoize into the given sqlite file """
+    global memo
+    memo = NormalizeMemo(maxsize, filename)
+    return memo
+
+def normalize_batch(ingredients):
+    """ Returns the normalized ingredients of every ingredient string, as
+    tuples identical to those of normalize. Each distinct string is looked
+    up in the memo once, and only normalized on a miss. """
+    results = {}
+    for ingredient in ingredients:
+        if ingredient in results:
+            continue
+        normalized = memo.get(ingredient)
+        if normalized is None:
+            normalized = tuple(normalize(ingredient))
+            memo.set(ingredient, normalized)
+        results[ingredient] = normalized
+    return [results[ingredient] for ingredient in ingredients]
+
 if __name__ == '__main__':
     ingredients = [
         u'a醤油',
@@ -0,0 +1,289 @@
+#!/usr/bin/env python
+
+import json
+import time
+import logging
+import argparse
+import threading
+import Queue
+from collections import deque
+from SocketServer import ThreadingMixIn
+from BaseHTTPServer import HTTPServer, BaseHTTPRequestHandler
+try:
+    import cPickle as pickle
+except:
+    import pickle
+
+import numpy as np
+import scipy.sparse as sp
+
+import features
+
+class Scorer(object):
+    """ Applies the feature extraction of classify.py and a pickled model
+    to recipes given as dicts """
+
+    def __init__(self, model, vectorizer, mask=None):
+        self.model = model
+        self.vectorizer = vectorizer
+        self.mask = mask
+
+    @classmethod
+    def load(cls, filename):
+        with open(filename) as f:
+            saved = pickle.load(f)
+        return cls(saved['model'], saved['vectorizer'], saved.get('mask'))
+
+    def vectorize(self, recipes):
+        instances = (features.extract_recipe(recipe) for recipe in recipes)
+        if self.mask is not None:
+            instances = features.filter(instances, self.mask)
+        return self.vectorizer.transform([f.todict() for f, label in instances])
+
+    def predict_proba(self, X):
+        return self.model.predict_proba(X)[:, 1]
+
+    def score(self, recipes):
+        return self.predict_proba(self.vectorize(recipes))
+
+class Stats(object):
+    """ Latency and throughput counters, over a bounded window of requests """
+
+    def __init__(self, window=10000):
+        self.lock = threading.Lock()
+        self.latencies = deque(maxlen=window)
+        self.batch_sizes = deque(maxlen=window)
+        self.start_time = time.time()
+        self.num_requests = 0
+        self.num_recipes = 0
+        self.num_errors = 0
+
+    def record_request(self, latency, num_recipes, error=False):
+        with self.lock:
+            self.latencies.append(latency)
+            self.num_requests += 1
+            self.num_recipes += num_recipes
+            self.num_errors += int(error)
+
+    def record_batch(self, num_recipes):
+        with self.lock:
+            self.batch_sizes.append(num_recipes)
+
+    def summary(self):
+        with self.lock:
+            latencies = np.array(self.latencies, dtype=np.float64)
+            batch_sizes = np.array(self.batch_sizes, dtype=np.float64)
+            uptime = time.time() - self.start_time
+            summary = {
+                'uptime': uptime,
+                'requests': self.num_requests,
+                'recipes': self.num_recipes,
+                'errors': self.num_errors,
+                'requests_per_second': self.num_requests / uptime,
+                'recipes_per_second': self.num_recipes / uptime,
+            }
+        if len(latencies):
+            summary['latency_p50'] = float(np.percentile(latencies, 50))
+            summary['latency_p99'] = float(np.percentile(latencies, 99))
+        if len(batch_sizes):
+            summary['mean_batch_size'] = float(batch_sizes.mean())
+        return summary
+
+class Timeout(Exception):
+    pass
+
+class _Pending(object):
+    def __init__(self, recipes):
+        self.recipes = recipes
+        # sized in the submitting thread, so that a bad payload fails there
+        self.size = len(recipes)
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+class MicroBatcher(object):
+    """ Gathers the recipes of concurrent requests into batches, so that
+    they are scored with a single predict_proba call.
+
+    A batch is closed once it holds max_batch_size recipes, or max_wait
+    seconds after its first request arrived. Feature extraction runs in
+    the batching thread only, so a single MeCab tagger is ever used.
+    Requests not answered within timeout seconds fail with Timeout. """
+
+    def __init__(self, scorer, stats, max_batch_size=64, max_wait=0.005, timeout=30.0):
+        self.scorer = scorer
+        self.stats = stats
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+        self.timeout = timeout
+        self.queue = Queue.Queue()
+        self.thread = threading.Thread(target=self.run)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def submit(self, recipes):
+        pending = _Pending(recipes)
+        self.queue.put(pending)
+        if not pending.done.wait(self.timeout):
+            raise Timeout('not scored within {} seconds'.format(self.timeout))
+        if pending.error is not None:
+            raise pending.error
+        return pending.result
+
+    def next_batch(self):
+        batch = [self.queue.get()]
+        size = batch[0].size
+        deadline = time.time() + self.max_wait
+        while size < self.max_batch_size:
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                break
+            try:
+                pending = self.queue.get(timeout=remaining)
+            except Queue.Empty:
+                break
+            batch.append(pending)
+            size += pending.size
+        return batch
+
+    def run(self):
+        while True:
+            batch = self.next_batch()
+            try:
+                self.score_batch(batch)
+            except Exception as e:
+                # never let the batching thread die, or every later request hangs
+                logging.exception('Scoring a batch failed')
+                for pending in batch:
+                    if not pending.done.is_set():
+                        pending.error = e
+                        pending.done.set()
+
+    def score_batch(self, batch):
+        # a malformed recipe only fails its own request
+        vectorized = []
+        for pending in batch:
+            try:
+                vectorized.append((pending, self.scorer.vectorize(pending.recipes)))
+            except Exception as e:
+                logging.exception('Extracting the features of a request failed')
+                pending.error = e
+                pending.done.set()
+
+        if not vectorized:
+            return
+        try:
+            X = sp.vstack([X for pending, X in vectorized], format='csr')
+            probabilities = self.scorer.predict_proba(X).tolist()
+        except Exception as e:
+            logging.exception('Scoring a batch failed')
+            for pending, X in vectorized:
+                pending.error = e
+                pending.done.set()
+            return
+
+        self.stats.record_batch(X.shape[0])
+        offset = 0
+        for pending, X in vectorized:
+            pending.result = probabilities[offset:offset + X.shape[0]]
+            offset += X.shape[0]
+            pending.done.set()
+
+class ScoringHandler(BaseHTTPRequestHandler):
+    """ POST /score with a recipe, or a list of recipes, as JSON.
+    GET /stats for latency and throughput counters.
+
+    Malformed payloads are answered with 400, failures to score a valid
+    payload with 500, and requests not scored in time with 503. """
+
+    def send_json(self, code, obj):
+        body = json.dumps(obj)
+        self.send_response(code)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        if self.path == '/stats':
+            self.send_json(200, self.server.stats.summary())
+        elif self.path == '/health':
+            self.send_json(200, {'status': 'ok'})
+        else:
+            self.send_json(404, {'error': 'not found'})
+
+    def do_POST(self):
+        if self.path != '/score':
+            self.send_json(404, {'error': 'not found'})
+            return
+
+        start = time.time()
+        try:
+            length = int(self.headers.getheader('Content-Length', 0))
+            payload = json.loads(self.rfile.read(length))
+        except ValueError as e:
+            self.send_json(400, {'error': str(e)})
+            return
+
+        single = isinstance(payload, dict)
+        recipes = [payload] if single else payload
+        if not (isinstance(recipes, list) and recipes and
+                all(isinstance(recipe, dict) for recipe in recipes)):
+            self.send_json(400, {'error': 'expected a recipe or a non-empty list of recipes'})
+            return
+        try:
+            probabilities = self.server.batcher.submit(recipes)
+        except Timeout as e:
+            self.server.stats.record_request(time.time() - start, len(recipes), error=True)
+            self.send_json(503, {'error': str(e)})
+            return
+        except Exception as e:
+            # the payload was valid, so the failure is ours, and the batching
+            # thread has logged it
+            self.server.stats.record_request(time.time() - start, len(recipes), error=True)
+            self.send_json(500, {'error': repr(e)})
+            return
+
+        self.server.stats.record_request(time.time() - start, len(recipes))
+        if single:
+            self.send_json(200, {'probability': probabilities[0]})
+        else:
+            self.send_json(200, {'probabilities': probabilities})
+
+    def log_message(self, format, *args):
+        logging.debug(format, *args)
+
+class ScoringServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address, scorer, max_batch_size=64, max_wait=0.005, timeout=30.0):
+        HTTPServer.__init__(self, address, ScoringHandler)
+        self.stats = Stats()
+        self.batcher = MicroBatcher(scorer, self.stats, max_batch_size, max_wait, timeout)
+
+def main():
+    logging.basicConfig(level=logging.INFO, format='%(message)s')
+
+    parser = argparse.ArgumentParser(description='Serve a model pickled by classify.py')
+    parser.add_argument('model', help='Pickled model file')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8000)
+    parser.add_argument('--max_batch_size', type=int, default=64,
+                        help='Maximum number of recipes scored together')
+    parser.add_argument('--max_wait_ms', type=float, default=5,
+                        help='Maximum time a request waits for others to batch with')
+    parser.add_argument('--timeout', type=float, default=30.0,
+                        help='Seconds after which a request not yet scored fails with 503')
+    args = parser.parse_args()
+
+    scorer = Scorer.load(args.model)
+    server = ScoringServer((args.host, args.port), scorer, args.max_batch_size,
+                           args.max_wait_ms / 1000.0, args.timeout)
+    logging.info('Serving on {}:{}'.format(args.host, args.port))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,127 @@
+#!/usr/bin/env python
+
+import io
+import sys
+import math
+import argparse
+try:
+    import cPickle as pickle
+except:
+    import pickle
+
+import jsonl
+import features
+
+class SparseModel(object):
+    """ Logistic regression model reduced to its non-zero weights.
+
+    Scores recipes straight from their FeatureVector, without sklearn,
+    a vectorizer, or a full coefficient vector. For models trained with
+    --hashing, weights are keyed by hashed column instead of feature name. """
+
+    def __init__(self, weights, intercept, mask=None, n_features=None):
+        self.weights = weights
+        self.intercept = intercept
+        self.mask = mask
+        self.n_features = n_features
+
+    @classmethod
+    def from_model(cls, model, vectorizer, mask=None):
+        coef = model.coef_[0]
+        intercept = float(model.intercept_[0])
+        nonzero = coef.nonzero()[0].tolist()
+
+        if hasattr(vectorizer, 'feature_names_'):
+            weights = dict((vectorizer.feature_names_[j], float(coef[j])) for j in nonzero)
+            return cls(weights, intercept, mask)
+
+        column_mask = vectorizer.column_mask_
+        weights = dict((j, float(coef[j])) for j in nonzero
+                       if column_mask is None or column_mask[j])
+        return cls(weights, intercept, mask, vectorizer.n_features)
+
+    def save(self, filename):
+        with io.open(filename, 'w', encoding='utf8') as f:
+            f.write(u'#intercept\t{!r}\n'.format(self.intercept))
+            if self.mask is not None:
+                f.write(u'#mask\t{}\n'.format(','.join(sorted(self.mask))))
+            if self.n_features is not None:
+                f.write(u'#hashing\t{}\n'.format(self.n_features))
+            for name, weight in sorted(self.weights.iteritems(), key=lambda x: -abs(x[1])):
+                f.write(u'{!r}\t{}\n'.format(weight, name))
+
+    @classmethod
+    def load(cls, filename):
+        weights, intercept, mask, n_features = {}, 0.0, None, None
+        with io.open(filename, encoding='utf8') as f:
+            for line in f:
+                value, name = line.rstrip(u'\n').split(u'\t', 1)
+                if value == u'#intercept':
+                    intercept = float(name)
+                elif value == u'#mask':
+                    mask = set(str(m) for m in name.split(u','))
+                elif value == u'#hashing':
+                    n_features = int(name)
+                else:
+                    weights[name] = float(value)
+        if n_features is not None:
+            weights = dict((int(name), weight) for name, weight in weights.iteritems())
+        return cls(weights, intercept, mask, n_features)
+
+    def decision_function(self, feature_vector):
+        z = self.intercept
+        if self.n_features is None:
+            for key, value in feature_vector.iteritems():
+                if self.mask is None or key[0] in self.mask:
+                    z += self.weights.get(':'.join(key), 0.0) * value
+            return z
+
+        # mirror HashedVectorizer: colliding features are summed, then clipped to 1
+        from hashing import feature_index
+        columns = {}
+        for key, value in feature_vector.iteritems():
+            if self.mask is None or key[0] in self.mask:
+                j = feature_index(':'.join(key), self.n_features)
+                columns[j] = columns.get(j, 0) + value
+        for j, value in columns.iteritems():
+            z += self.weights.get(j, 0.0) * min(value, 1)
+        return z
+
+    def score(self, feature_vector):
+        """ Probability of the positive class, as predict_proba would give """
+        z = self.decision_function(feature_vector)
+        if z >= 0:
+            return 1.0 / (1.0 + math.exp(-z))
+        e = math.exp(z)
+        return e / (1.0 + e)
+
+    def score_recipe(self, recipe):
+        feature_vector, label = features.extract_recipe(recipe)
+        return self.score(feature_vector)
+
+def main():
+    parser = argparse.ArgumentParser(description='Export a model pickled by classify.py '
+                                                 'to a sparse weight table, or score with it')
+    subparsers = parser.add_subparsers(dest='command')
+
+    export_parser = subparsers.add_parser('export', help='Write the non-zero weights')
+    export_parser.add_argument('model', help='Pickled model file')
+    export_parser.add_argument('weights', help='Output weight table file')
+
+    score_parser = subparsers.add_parser('score', help='Score a JSONL file of recipes')
+    score_parser.add_argument('weights', help='Weight table file')
+    score_parser.add_argument('json', help='Input data file')
+    args = parser.parse_args()
+
+    if args.command == 'export':
+        with open(args.model) as f:
+            saved = pickle.load(f)
+        model = SparseModel.from_model(saved['model'], saved['vectorizer'], saved.get('mask'))
+        model.save(args.weights)
+    else:
+        model = SparseModel.load(args.weights)
+        for recipe in jsonl.records(args.json):
+            sys.stdout.write('{}\t{}\n'.format(recipe['id'], model.score_recipe(recipe)))
+
+if __name__ == '__main__':
+    main()
@@ -7,11 +7,16 @@ import random
 import json
 import time
 import datetime
+import hashlib
+import struct
+from collections import defaultdict
+
+import jsonl
+
+SPLITS = ('train', 'dev', 'test')
 
 def load_data(filename):
-    with open(filename, 'r') as f:
-        for line in f:
-            yield json.loads(line.strip())
+    return jsonl.records(filename)
 
 def read_date(date_str):
     try:
@@ -24,6 +29,61 @@ def has_progressed(days, t1, t2):
     t2 = datetime.datetime.fromtimestamp(time.mktime(t2))
     return (t2 - t1).days > days
 
+def parse_date(date_str):
+    """ Same as read_date, but returns a datetime.date and avoids both
+    strptime and exceptions """
+    if '-' in date_str:
+        year, month, day = date_str.split('-')
+        year = int(year)
+    else:
+        year, month, day = date_str.split('/')
+        year = int(year)
+        # same pivot as strptime's %y
+        year += 2000 if year < 69 else 1900
+    return datetime.date(year, int(month), int(day))
+
+def assign_split(recipe, counts, seed, ratios):
+    """ Assigns a recipe to the split which is furthest below its ratio among
+    the recipes of the same label assigned so far, and counts it in counts,
+    which maps labels to per-split counts. Every label is thus split in the
+    given ratios, up to about one recipe, at any point of the stream. Ties are
+    broken deterministically by a hash of the recipe id and the seed. """
+    label_counts = counts[recipe['label']]
+    num_data = sum(label_counts) + 1
+    deficits = [ratio * num_data - count for ratio, count in zip(ratios, label_counts)]
+    candidates = [i for i, deficit in enumerate(deficits)
+                  if deficit >= max(deficits) - 1e-9]
+    key = '{}:{}'.format(seed, recipe['id'])
+    x = struct.unpack('>Q', hashlib.md5(key).digest()[:8])[0] / float(2 ** 64)
+    i = candidates[int(x * len(candidates))]
+    label_counts[i] += 1
+    return SPLITS[i]
+
+def stream_split(data, output_dir, threshold, seed, crawl_date,
+                 train_ratio=0.7, dev_ratio=0.2):
+    """ Splits data in a single pass, writing each recipe as soon as it is read """
+    ratios = (train_ratio, dev_ratio, 1 - train_ratio - dev_ratio)
+    counts = defaultdict(lambda: [0] * len(SPLITS))
+    files = dict((split, open(os.path.join(output_dir, split + '.json'), 'w'))
+                 for split in SPLITS)
+    num_pos, num_neg = 0, 0
+    try:
+        for d in data:
+            if (crawl_date - parse_date(d['published_date'])).days <= 90:
+                continue
+            if d['report_count'] >= threshold:
+                d['label'] = 1
+                num_pos += 1
+            else:
+                d['label'] = 0
+                num_neg += 1
+            split = assign_split(d, counts, seed, ratios)
+            files[split].write('{}\n'.format(json.dumps(d)))
+    finally:
+        for f in files.itervalues():
+            f.close()
+    return num_pos, num_neg
+
 def main():
     logging.basicConfig(level=logging.INFO, format='%(message)s')
 
@@ -33,11 +93,23 @@ def main():
     parser.add_argument('--threshold', type=int, default=10)
     parser.add_argument('--seed', type=int, default=0)
     parser.add_argument('--crawl_date', type=read_date, default='2013-08-01')
+    parser.add_argument('--streaming', action='store_true',
+                        help='Split in a single pass, stratified by label, '
+                             'without holding the data in memory')
     args = parser.parse_args()
 
+    data = load_data(args.json)
+
+    if args.streaming:
+        crawl_date = datetime.date(*args.crawl_date[:3])
+        num_pos, num_neg = stream_split(data, args.output_dir, args.threshold, args.seed,
+                                        crawl_date)
+        logging.info('Size of pos data: {}'.format(num_pos))
+        logging.info('Size of neg data: {}'.format(num_neg))
+        return
+
     random.seed(args.seed)
 
-    data = load_data(args.json)
     data = filter(lambda d: has_progressed(90,
                                            read_date(d['published_date']),
                                            args.crawl_date), data)
@@ -72,6 +144,12 @@ def main():
     dev_data = pos_data[pos_split1:pos_split2] + neg_data[neg_split1:neg_split2]
     test_data = pos_data[pos_split2:] + neg_data[neg_split2:]
 
+    # positives and negatives would otherwise be written one after the other,
+    # which minibatch training reads in file order
+    random.shuffle(train_data)
+    random.shuffle(dev_data)
+    random.shuffle(test_data)
+
     def write_file(filename, data):
         with open(filename, 'w') as f:
             for d in data:
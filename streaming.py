@@ -0,0 +1,97 @@
+#!/usr/bin/env python
+
+import logging
+
+import numpy as np
+import scipy.sparse as sp
+from sklearn.linear_model import SGDClassifier
+
+import features
+import hashing
+import instrument
+from streaming_eval import StreamingEvaluator, DEFAULT_BINS
+
+CLASSES = np.array([0, 1])
+SHUFFLE_BATCHES = 10
+
+def minibatches(vectorizer, filename, batch_size=10000, jobs=1):
+    """ Yields (X, y) for consecutive batches of recipes in filename.
+    Only a bounded number of batches is ever held in memory. """
+    unpruned = hashing.HashedVectorizer(vectorizer.n_features, vectorizer.mask)
+    for X, y in features.map_lines(hashing.transform_lines, filename, jobs, batch_size,
+                                   args=(unpruned,)):
+        instrument.count('records', X.shape[0])
+        yield vectorizer.prune(X), y
+
+def fit_prune(vectorizer, filename, threshold, batch_size=10000, jobs=1):
+    """ Pre-pass which counts document frequencies batch by batch
+    and sets the column mask of vectorizer. Returns the number of
+    recipes of every class. """
+    document_frequency = np.zeros(vectorizer.n_features, dtype=np.int64)
+    label_counts = np.zeros(len(CLASSES), dtype=np.int64)
+    for X, y in minibatches(vectorizer, filename, batch_size, jobs):
+        document_frequency += vectorizer.document_frequency(X)
+        label_counts += np.bincount(y, minlength=len(CLASSES))
+    vectorizer.fit_document_frequency(document_frequency, int(label_counts.sum()), threshold)
+    return label_counts
+
+def class_weights(label_counts):
+    """ Same weights as class_weight='auto', which partial_fit does not
+    accept, from the class counts of fit_prune """
+    num_data = float(label_counts.sum())
+    return dict((c, num_data / (len(CLASSES) * count) if count else 1.0)
+                for c, count in zip(CLASSES.tolist(), label_counts.tolist()))
+
+def _mix(batches, random_state):
+    sizes = [batch_X.shape[0] for batch_X, batch_y in batches]
+    X = sp.vstack([batch_X for batch_X, batch_y in batches], format='csr')
+    y = np.concatenate([batch_y for batch_X, batch_y in batches])
+    order = random_state.permutation(X.shape[0])
+    X, y = X[order], y[order]
+    ends = np.cumsum(sizes)
+    for i in random_state.permutation(len(batches)):
+        start = ends[i] - sizes[i]
+        yield X[start:ends[i]], y[start:ends[i]]
+
+def shuffle(batches, random_state, buffer_size=SHUFFLE_BATCHES):
+    """ Shuffles the rows of every buffer_size consecutive batches together,
+    and yields them as batches of the same sizes in random order. Only
+    buffer_size batches are held in memory, so the order is shuffled locally. """
+    buffered = []
+    for batch in batches:
+        buffered.append(batch)
+        if len(buffered) >= buffer_size:
+            for mixed in _mix(buffered, random_state):
+                yield mixed
+            buffered = []
+    if buffered:
+        for mixed in _mix(buffered, random_state):
+            yield mixed
+
+def train(vectorizer, filename, epochs=5, batch_size=10000, jobs=1, alpha=0.0001,
+          dev_filename=None, class_weight=None, shuffle_batches=SHUFFLE_BATCHES, seed=0):
+    """ Trains an L1-regularized logistic regression model with partial_fit,
+    one minibatch at a time. Every epoch shuffles the recipes within groups
+    of shuffle_batches minibatches, so that a file sorted by label is not
+    learnt one class after the other. """
+    model = SGDClassifier(loss='log', penalty='l1', alpha=alpha, class_weight=class_weight)
+    for epoch in xrange(epochs):
+        logging.info('Epoch {0}'.format(epoch + 1))
+        random_state = np.random.RandomState(seed + epoch)
+        for X, y in shuffle(minibatches(vectorizer, filename, batch_size, jobs),
+                            random_state, shuffle_batches):
+            model.partial_fit(X, y, classes=CLASSES)
+        if dev_filename is not None:
+            evaluator = evaluate(model, vectorizer, dev_filename, batch_size, jobs)
+            logging.info('Dev score: {0}'.format(evaluator.f1()))
+    return model
+
+def evaluate(model, vectorizer, filename, batch_size=10000, jobs=1, bins=DEFAULT_BINS,
+             scores=False):
+    """ Returns a StreamingEvaluator of model over filename, with the
+    histogram of positive class scores if scores is set """
+    evaluator = StreamingEvaluator(bins)
+    for X, y in minibatches(vectorizer, filename, batch_size, jobs):
+        batch_scores = model.predict_proba(X)[:, 1] if scores else None
+        evaluator.update(y, model.predict(X), batch_scores)
+    return evaluator
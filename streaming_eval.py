@@ -0,0 +1,104 @@
+#!/usr/bin/env python
+
+import numpy as np
+
+DEFAULT_BINS = 1000
+
+def f1(conf_mat):
+    tp = conf_mat[1, 1]
+    denominator = 2 * tp + conf_mat[0, 1] + conf_mat[1, 0]
+    return 2.0 * tp / denominator if denominator else 0.0
+
+class StreamingEvaluator(object):
+    """ Binary classification metrics accumulated chunk by chunk in fixed memory.
+
+    Holds the confusion matrix, and histograms of the positive class scores
+    of the actual positives and negatives over bins equal-width bins of
+    [0, 1]. The precision-recall curve is computed from the histograms, so
+    its resolution is that of the bins rather than of the distinct scores.
+    Evaluators of disjoint chunks, e.g. from worker processes, are merged
+    by adding their counts. """
+
+    def __init__(self, bins=DEFAULT_BINS):
+        self.bins = bins
+        self.conf_mat = np.zeros((2, 2), dtype=np.int64)
+        self.positives = np.zeros(bins, dtype=np.int64)
+        self.negatives = np.zeros(bins, dtype=np.int64)
+
+    def update(self, y_true, y_pred, scores=None):
+        """ Adds a chunk of labels, predicted labels, and optionally
+        positive class scores """
+        y_true = np.asarray(y_true, dtype=np.int64)
+        y_pred = np.asarray(y_pred, dtype=np.int64)
+        self.conf_mat += np.bincount(2 * y_true + y_pred, minlength=4).reshape(2, 2)
+        if scores is not None:
+            index = np.clip((np.asarray(scores) * self.bins).astype(np.int64), 0, self.bins - 1)
+            positive = y_true == 1
+            self.positives += np.bincount(index[positive], minlength=self.bins)
+            self.negatives += np.bincount(index[~positive], minlength=self.bins)
+        return self
+
+    def merge(self, other):
+        if other.bins != self.bins:
+            raise ValueError('Cannot merge evaluators with {} and {} bins'.format(
+                self.bins, other.bins))
+        self.conf_mat += other.conf_mat
+        self.positives += other.positives
+        self.negatives += other.negatives
+        return self
+
+    @property
+    def num_data(self):
+        return int(self.conf_mat.sum())
+
+    def f1(self):
+        return f1(self.conf_mat)
+
+    def accuracy(self):
+        num_data = self.num_data
+        return float(np.trace(self.conf_mat)) / num_data if num_data else 0.0
+
+    def pr_curve(self):
+        """ Returns (precision, recall, thresholds) in the layout of sklearn's
+        precision_recall_curve: thresholds are the lower edges of the bins
+        holding scores, in increasing order, starting from the highest one
+        at which recall is 1, and the last precision and recall are 1 and 0 """
+        # number of actual positives and negatives scored at or above each bin
+        tp = np.cumsum(self.positives[::-1])[::-1]
+        fp = np.cumsum(self.negatives[::-1])[::-1]
+        used = np.flatnonzero(self.positives + self.negatives)
+        if not len(used):
+            return np.ones(1), np.zeros(1), np.zeros(0)
+        tp, fp = tp[used], fp[used]
+        thresholds = used.astype(np.float64) / self.bins
+
+        start = np.flatnonzero(tp == tp[0])[-1]
+        tp, fp, thresholds = tp[start:], fp[start:], thresholds[start:]
+        precision = tp.astype(np.float64) / (tp + fp)
+        recall = tp.astype(np.float64) / tp[0] if tp[0] else np.zeros(len(tp))
+        return (np.append(precision, 1.0), np.append(recall, 0.0), thresholds)
+
+    def pr_auc(self):
+        """ Area under the precision-recall curve, by the trapezoidal rule """
+        precision, recall, thresholds = self.pr_curve()
+        return float(-np.sum(np.diff(recall) * (precision[1:] + precision[:-1])) / 2.0)
+
+    def report(self):
+        return {
+            'num_data': self.num_data,
+            'f1': float(self.f1()),
+            'accuracy': self.accuracy(),
+            'confusion_matrix': self.conf_mat.tolist(),
+        }
+
+def evaluate(model, X, y, chunk_size=10000, bins=DEFAULT_BINS, scores=False):
+    """ Evaluates model on the rows of X chunk_size at a time, so that neither
+    the predictions nor the scores of the whole matrix are held in memory.
+    Positive class scores are only computed if scores is set. """
+    evaluator = StreamingEvaluator(bins)
+    for start in xrange(0, X.shape[0], chunk_size):
+        X_chunk = X[start:start + chunk_size]
+        y_chunk = y[start:start + chunk_size]
+        chunk_scores = model.predict_proba(X_chunk)[:, 1] if scores else None
+        evaluator.update(y_chunk, model.predict(X_chunk), chunk_scores)
+    return evaluator
@@ -0,0 +1,117 @@
+#!/usr/bin/env python
+
+import copy
+import logging
+import multiprocessing
+
+from sklearn.linear_model import LogisticRegression
+from sklearn.metrics import f1_score
+
+import instrument
+
+DEFAULT_GRID = (0.01, 0.1, 1, 10, 100, 1000)
+
+CLASS_WEIGHT = 'auto'
+
+# saga only exists from scikit-learn 0.19, which no longer accepts 'auto',
+# so the warm-started path uses its replacement
+PATH_CLASS_WEIGHT = 'balanced'
+
+# Matrices are stored here before the worker pool forks, so that workers
+# read them from the inherited address space instead of having them
+# pickled along with every task
+_shared = {}
+
+def make_model(regularization, warm_start=False):
+    if warm_start:
+        # liblinear cannot resume from a previous solution, saga can
+        return LogisticRegression(penalty='l1', C=regularization,
+                                  class_weight=PATH_CLASS_WEIGHT, solver='saga',
+                                  warm_start=True)
+    return LogisticRegression(penalty='l1', C=regularization, class_weight=CLASS_WEIGHT)
+
+def _fit(regularization):
+    X_train, y_train, X_dev, y_dev = _shared['data']
+    model = make_model(regularization)
+    model.fit(X_train, y_train)
+    score = f1_score(y_dev, model.predict(X_dev))
+    return score, regularization, model
+
+class Best(object):
+    """ Keeps track of the best candidate only, and of how many candidates
+    in a row have failed to improve on it """
+
+    def __init__(self):
+        self.score = None
+        self.regularization = None
+        self.model = None
+        self.stale = 0
+
+    def update(self, score, regularization, model):
+        logging.info('regularization parameter: {0}'.format(regularization))
+        logging.info('Dev score: {0}'.format(score))
+        instrument.count('fits')
+        if self.score is None or score > self.score:
+            self.score, self.regularization, self.model = score, regularization, model
+            self.stale = 0
+        else:
+            self.stale += 1
+
+    def exhausted(self, patience):
+        return patience is not None and self.stale >= patience
+
+def _sweep_path(X_train, y_train, X_dev, y_dev, grid, patience):
+    best = Best()
+    model = make_model(grid[0], warm_start=True)
+    for regularization in grid:
+        model.set_params(C=regularization)
+        model.fit(X_train, y_train)
+        score = f1_score(y_dev, model.predict(X_dev))
+        # the next fit starts from this solution in place, so the best
+        # model has to be copied out
+        is_best = best.score is None or score > best.score
+        best.update(score, regularization, copy.deepcopy(model) if is_best else None)
+        if best.exhausted(patience):
+            logging.info('Dev score stopped improving, stopping early')
+            break
+    return best
+
+def sweep(X_train, y_train, X_dev, y_dev, grid=DEFAULT_GRID, jobs=1, patience=None,
+          warm_start=False):
+    """ Fits one L1-regularized model per value in grid and returns
+    (score, regularization, model) of the one with the best dev F1.
+
+    With warm_start, the grid is walked in increasing order as a
+    regularization path, each fit starting from the previous solution.
+    Otherwise candidates are fit concurrently in jobs processes, and
+    reported in increasing order as well. With patience, the sweep stops
+    once that many candidates in a row have not improved the dev F1. """
+    grid = sorted(grid)
+    if warm_start:
+        best = _sweep_path(X_train, y_train, X_dev, y_dev, grid, patience)
+        return best.score, best.regularization, best.model
+
+    best = Best()
+    _shared['data'] = (X_train, y_train, X_dev, y_dev)
+    try:
+        if jobs <= 1:
+            results = (_fit(regularization) for regularization in grid)
+            pool = None
+        else:
+            pool = multiprocessing.Pool(jobs)
+            results = pool.imap(_fit, grid)
+
+        try:
+            for score, regularization, model in results:
+                best.update(score, regularization, model)
+                if best.exhausted(patience):
+                    logging.info('Dev score stopped improving, stopping early')
+                    break
+        finally:
+            if pool is not None:
+                pool.terminate()
+                pool.join()
+    finally:
+        _shared.clear()
+
+    return best.score, best.regularization, best.model
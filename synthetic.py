@@ -0,0 +1,86 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import json
+import random
+import argparse
+
+INGREDIENTS = [
+    u'醤油', u'ごま油', u'塩', u'片栗粉', u'里芋', u'ケチャップ', u'ソース', u'じゃこ',
+    u'白胡麻', u'海苔', u'オリーブオイル', u'梅干し', u'ローリエ', u'葉野菜', u'泡盛',
+    u'カレールー', u'しめじ', u'えのき', u'キウリ', u'ハム', u'錦糸卵', u'水', u'酒',
+    u'すり胡麻', u'ニンニク', u'豚薄切り肉', u'一味唐辛子', u'七味唐辛子', u'コリアンダー',
+    u'もやし', u'砂糖', u'みりん', u'味噌', u'卵', u'玉ねぎ', u'人参', u'じゃがいも',
+    u'豚肉', u'鶏もも肉', u'牛乳', u'バター', u'薄力粉', u'生クリーム', u'大根', u'キャベツ',
+    u'ほうれん草', u'豆腐', u'ツナ缶', u'マヨネーズ', u'生姜', u'長ねぎ', u'ベーコン',
+]
+
+# decorations in the style of the examples in preprocessing.py
+PREFIXES = [u'', u'', u'', u'', u'a', u'B', u'A ', u'A.', u'A)', u'(', u'@', u'★', u'●',
+            u'お好みの', u'あれば', u'市販の', u'お好きな', u'生']
+SUFFIXES = [u'', u'', u'', u'', u'(みじん切り)', u'<みじん切り>...A ', u'＜みじん切り＞...A ',
+            u'【何でも】', u'（今回はID：1384495 を使いました。）', u'(冷凍もの可', u'等',
+            u'など', u' ', u'♪', u'☆']
+SEPARATORS = [u'、', u'・', u'+', u'or', u'/', u'又は']
+
+WORDS = [
+    u'フライパン', u'１つ', u'で', u'簡単', u'ボリューム', u'たっぷり', u'の', u'１品', u'です',
+    u'話題入り', u'させて', u'頂き', u'ました', u'ありがとう', u'ござい', u'ます', u'皆さま',
+    u'本当に', u'美味しい', u'子供', u'大好き', u'節約', u'時短', u'お弁当', u'に', u'ぴったり',
+    u'レンジ', u'だけ', u'ふわふわ', u'とろとろ', u'ヘルシー', u'人気', u'定番', u'おかず',
+    u'つくれぽ', u'感謝', u'作って', u'２００７', u'１００人', u'❤', u'♪', u'(o*。_。)oペコッ',
+]
+
+def ingredient(rng):
+    """ A messy ingredient line, as typed by Cookpad users """
+    name = rng.choice(INGREDIENTS)
+    if rng.random() < 0.15:
+        name = u'{}{}{}'.format(name, rng.choice(SEPARATORS), rng.choice(INGREDIENTS))
+    return u'{}{}{}'.format(rng.choice(PREFIXES), name, rng.choice(SUFFIXES))
+
+def sentence(rng, min_words, max_words):
+    return u''.join(rng.choice(WORDS) for _ in xrange(rng.randint(min_words, max_words)))
+
+def recipe(rng, recipe_id, num_authors=1000):
+    report_count = int(rng.paretovariate(1.2)) - 1
+    recipe = {
+        'id': recipe_id,
+        'name': sentence(rng, 2, 6),
+        'description': sentence(rng, 5, 30),
+        'category': rng.randint(1, 1000),
+        'categories': [rng.randint(1, 1000) for _ in xrange(rng.randint(1, 4))],
+        'ingredients': [ingredient(rng) for _ in xrange(rng.randint(2, 15))],
+        'author': rng.randint(1, num_authors),
+        'report_count': report_count,
+        'published_date': '{:02d}/{:02d}/{:02d}'.format(rng.randint(8, 13), rng.randint(1, 12),
+                                                       rng.randint(1, 28)),
+        'label': int(report_count >= 5),
+    }
+    if rng.random() < 0.9:
+        recipe['image_main'] = 'http://img.example.com/recipes/{}.jpg'.format(recipe_id)
+    recipe['images_instruction'] = ['http://img.example.com/steps/{}/{}.jpg'.format(recipe_id, i)
+                                    for i in xrange(rng.randint(0, 6))]
+    return recipe
+
+def generate(n, seed=0):
+    """ Yields n synthetic recipes; the same seed always gives the same recipes """
+    rng = random.Random(seed)
+    for recipe_id in xrange(1, n + 1):
+        yield recipe(rng, recipe_id)
+
+def write(filename, n, seed=0):
+    with open(filename, 'w') as f:
+        for r in generate(n, seed):
+            f.write('{}\n'.format(json.dumps(r)))
+
+def main():
+    parser = argparse.ArgumentParser(description='Generate synthetic Cookpad-like recipes')
+    parser.add_argument('json', help='Output data file')
+    parser.add_argument('--n', type=int, default=10000, help='Number of recipes')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    write(args.json, args.n, args.seed)
+
+if __name__ == '__main__':
+    main()